@@ -0,0 +1,111 @@
+"""
+Pagination classes shared by the apps.
+"""
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+
+
+class ApproximateCountPaginator(DjangoPaginator):
+    """Django paginator that uses the query planner's row estimate instead
+       of an exact COUNT(*) for large querysets. Below the threshold
+       counting is cheap, so the exact count is returned."""
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        estimate = self._estimate_count()
+        if estimate is None or estimate < self.threshold:
+            return super().count
+        return estimate
+
+    def _estimate_count(self):
+        """Return the planner's estimate of the number of rows. Only
+           possible for querysets on PostgreSQL, returns None otherwise."""
+        query = getattr(self.object_list, 'query', None)
+        if query is None:
+            return None
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql':
+            return None
+        sql, params = query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        return plan[0]['Plan']['Plan Rows']
+
+
+class KeysetCursorPagination(CursorPagination):
+    """Cursor pagination keyed on (created_at, id), or on the ordering
+       returned by the view's `get_ordering`. Every page is a range scan
+       on the index instead of an OFFSET scan."""
+    ordering = ('-created_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = view.get_ordering() if hasattr(view, 'get_ordering') else None
+        return ordering or super().get_ordering(request, queryset, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # A row without a value of the first ordering field (e.g. a product
+        # without a price) can't be the cursor position, so it is not listed
+        field = self.get_ordering(request, queryset, view)[0].lstrip('-')
+        return super().paginate_queryset(queryset.exclude(**{f'{field}__isnull': True}), request, view)
+
+
+class KeysetPagination(PageNumberPagination):
+    """Page number pagination with two opt-in modes for large tables:
+       - `?pagination=cursor` switches to the `KeysetCursorPagination`,
+         which does not count rows and does not use OFFSET. Only querysets
+         can be paginated this way, other lists (like search results)
+         keep using page numbers,
+       - `?count=approximate` replaces the exact COUNT(*) with the
+         planner's estimate on large querysets."""
+    cursor_pagination_class = KeysetCursorPagination
+    cursor_paginator = None
+
+    def use_cursor(self, request):
+        return request.query_params.get('pagination') == 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request) and isinstance(queryset, QuerySet):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+
+        if request.query_params.get('count') == 'approximate':
+            self.django_paginator_class = ApproximateCountPaginator
+        return super().paginate_queryset(queryset, request, view)
+
+    def recount(self):
+        """Count the paginated list again, e.g. after it has changed
+           since the page was validated."""
+        if self.page is not None:
+            for attr in ('count', 'num_pages'):
+                self.page.paginator.__dict__.pop(attr, None)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters += self.cursor_pagination_class().get_schema_operation_parameters(view)
+        parameters += [
+            {
+                'name': 'pagination',
+                'required': False,
+                'in': 'query',
+                'description': 'Set to `cursor` to use cursor pagination.',
+                'schema': {'type': 'string', 'enum': ['cursor']},
+            },
+            {
+                'name': 'count',
+                'required': False,
+                'in': 'query',
+                'description': 'Set to `approximate` to get an estimated count on large lists.',
+                'schema': {'type': 'string', 'enum': ['approximate']},
+            },
+        ]
+        return parameters
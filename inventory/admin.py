@@ -9,3 +9,4 @@ admin.site.register(models.ProductAttribute)
 admin.site.register(models.ProductAttributeValue)
 admin.site.register(models.ProductImage)
 admin.site.register(models.Stock)
+admin.site.register(models.ProductListingRow)
@@ -0,0 +1,175 @@
+"""
+Caching of API responses under tags, so that cached responses can be
+invalidated as soon as the data they were built from changes.
+"""
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import WatchError
+from rest_framework import status
+from rest_framework.response import Response
+
+TAG_KEY_PREFIX = 'inventory:cache-tag:'
+
+
+def _tag_key(tag):
+    return f'{TAG_KEY_PREFIX}{tag}'
+
+
+def set_tagged(key, value, timeout, tags):
+    """Cache the value and remember its key in a Redis set of every tag.
+       Both are written in one MULTI transaction, so an invalidation
+       can't run in between and miss the stored value."""
+    pipeline = get_redis_connection('default').pipeline()
+    cache.set(key, value, timeout, client=pipeline)
+    for tag in tags:
+        pipeline.sadd(_tag_key(tag), key)
+        # Tag sets live as long as the entries they point to
+        pipeline.expire(_tag_key(tag), timeout)
+    pipeline.execute()
+
+
+def invalidate_tags(tags):
+    """Delete all cached values stored under any of the tags."""
+    tag_keys = [_tag_key(tag) for tag in set(tags)]
+    if not tag_keys:
+        return
+    redis = get_redis_connection('default')
+    keys = redis.sunion(tag_keys)
+    if keys:
+        cache.delete_many([key.decode() for key in keys])
+        # Keys stored after the union are kept in the tag sets
+        pipeline = redis.pipeline()
+        for tag_key in tag_keys:
+            pipeline.srem(tag_key, *keys)
+        pipeline.execute()
+
+
+def acquire_lock(key, timeout):
+    """Take the Redis lock under the key for `timeout` seconds. Return
+       a unique token of the holder, or None if the lock is taken."""
+    token = uuid.uuid4().hex
+    if get_redis_connection('default').set(key, token, nx=True, ex=timeout):
+        return token
+    return None
+
+
+def release_lock(key, token):
+    """Release the lock, only if it's still held with the token. It may
+       have expired and been taken by another request meanwhile.
+       The compare-and-delete runs in a WATCH/MULTI transaction."""
+    with get_redis_connection('default').pipeline() as pipeline:
+        try:
+            pipeline.watch(key)
+            if pipeline.get(key) == token.encode():
+                pipeline.multi()
+                pipeline.delete(key)
+                pipeline.execute()
+        except WatchError:
+            # The lock changed meanwhile, so it's held by someone else
+            pass
+
+
+def is_locked(key):
+    """Return whether the lock under the key is held."""
+    return bool(get_redis_connection('default').exists(key))
+
+
+class TaggedCacheMixin:
+    """Mixin for list views that caches response data under tags
+       returned by `get_cache_tags`, instead of a fixed-time `cache_page`.
+       Responses are invalidated by the inventory signal handlers,
+       so they can be cached for a long time.
+
+       Cache fills are protected from stampedes: entries are refreshed
+       a bit early with a probability growing towards their expiry,
+       only one request (holding a lock) rebuilds a given entry, and the
+       others serve the stale value for up to `cache_stale_timeout`."""
+    cache_timeout = 60 * 60
+    cache_stale_timeout = 60 * 10
+    cache_lock_timeout = 30
+    cache_lock_wait = 2
+    cache_lock_poll_interval = 0.05
+    cache_early_expiry_beta = 1.0
+
+    def get_cache_params(self, request):
+        """Return everything the response depends on. Query params are
+           sorted, so their order does not matter. Cookies are left out,
+           so anonymous visitors share the same entries."""
+        return {
+            'kwargs': self.kwargs,
+            'query': {key: sorted(values) for key, values in request.query_params.lists()},
+            'authenticated': request.user.is_authenticated,
+        }
+
+    def get_cache_key(self, request):
+        """Return the cache key built from the `get_cache_params`."""
+        cache_id = json.dumps(self.get_cache_params(request), sort_keys=True, default=str)
+        digest = hashlib.md5(cache_id.encode()).hexdigest()
+        return f'inventory:response:{self.__class__.__name__}:{digest}'
+
+    def get_cache_tags(self, data):
+        """Return tags for the response data."""
+        return []
+
+    def should_cache(self, response):
+        """Return whether the response should be cached."""
+        return response.status_code == status.HTTP_200_OK
+
+    def needs_refresh(self, entry):
+        """Return whether the entry should be rebuilt. Entries that took
+           longer to compute are more likely to be refreshed early
+           (probabilistic early expiration, "XFetch")."""
+        early_by = -entry['compute_time'] * self.cache_early_expiry_beta * math.log(1 - random.random())
+        return time.time() + early_by >= entry['expires_at']
+
+    def wait_for_entry(self, key):
+        """Wait for another request to fill the entry, return None on timeout."""
+        deadline = time.monotonic() + self.cache_lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(self.cache_lock_poll_interval)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+        return None
+
+    def fill_cache(self, key, request, *args, **kwargs):
+        """Build the response and cache its data if it succeeded."""
+        started_at = time.monotonic()
+        response = super().get(request, *args, **kwargs)
+        if self.should_cache(response):
+            entry = {
+                'data': response.data,
+                'expires_at': time.time() + self.cache_timeout,
+                'compute_time': time.monotonic() - started_at,
+            }
+            set_tagged(key, entry, self.cache_timeout + self.cache_stale_timeout,
+                       self.get_cache_tags(response.data))
+        return response
+
+    def get(self, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        entry = cache.get(key)
+        if entry is not None and not self.needs_refresh(entry):
+            return Response(entry['data'])
+
+        lock_key = f'{key}:lock'
+        token = acquire_lock(lock_key, self.cache_lock_timeout)
+        if token is not None:
+            try:
+                return self.fill_cache(key, request, *args, **kwargs)
+            finally:
+                release_lock(lock_key, token)
+
+        # Another request is rebuilding the entry
+        if entry is None:
+            entry = self.wait_for_entry(key)
+        if entry is not None:
+            return Response(entry['data'])
+        return self.fill_cache(key, request, *args, **kwargs)
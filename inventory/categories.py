@@ -0,0 +1,52 @@
+"""
+Building and caching the whole category tree.
+"""
+from django.core.cache import cache
+
+from .models import Category
+
+CATEGORY_TREE_VERSION_KEY = 'inventory:category-tree-version'
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24
+CATEGORY_TREE_FIELDS = ['id', 'name', 'slug', 'is_active', 'level', 'parent_id']
+
+
+def build_category_tree(categories):
+    """Build nested category dicts from categories ordered by the MPTT
+       `tree_id` and `lft`, so every parent comes before its children."""
+    nodes = {}
+    tree = []
+    for category in categories:
+        parent_id = category.pop('parent_id')
+        node = {**category, 'children': []}
+        nodes[node['id']] = node
+        if parent_id is None:
+            tree.append(node)
+        else:
+            nodes[parent_id]['children'].append(node)
+    return tree
+
+
+def get_category_tree_version():
+    """Return the current version of the category tree."""
+    cache.add(CATEGORY_TREE_VERSION_KEY, 1, None)
+    return cache.get(CATEGORY_TREE_VERSION_KEY)
+
+
+def bump_category_tree_version():
+    """Make the cached category tree outdated."""
+    try:
+        cache.incr(CATEGORY_TREE_VERSION_KEY)
+    except ValueError:
+        cache.add(CATEGORY_TREE_VERSION_KEY, 1, None)
+
+
+def get_category_tree():
+    """Return the category tree, loaded with one query and cached
+       until any category changes."""
+    key = f'inventory:category-tree:{get_category_tree_version()}'
+    tree = cache.get(key)
+    if tree is None:
+        categories = Category.objects.order_by('tree_id', 'lft').values(*CATEGORY_TREE_FIELDS)
+        tree = build_category_tree(categories)
+        cache.set(key, tree, CATEGORY_TREE_TIMEOUT)
+    return tree
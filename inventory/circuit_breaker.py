@@ -0,0 +1,86 @@
+"""
+Circuit breaker with its state kept in the cache (Redis), so all
+workers stop calling a failing service at the same time.
+"""
+from django.core.cache import cache
+
+
+class CircuitBreakerError(Exception):
+    """The circuit is open or the protected call has failed."""
+
+
+class CircuitBreaker:
+    """Stops calling a service after `failure_threshold` failures (within
+       `failure_window` seconds). When open, calls fail right away for
+       `recovery_timeout` seconds. Then one call is a trial (other calls
+       still fail right away) - its failure opens the circuit again,
+       its success closes it."""
+
+    def __init__(self, name, errors, failure_threshold=5, recovery_timeout=30, failure_window=60):
+        self.name = name
+        self.errors = errors
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failure_window = failure_window
+
+    @property
+    def _key(self):
+        return f'inventory:circuit-breaker:{self.name}'
+
+    def is_open(self):
+        return cache.get(f'{self._key}:open') is not None
+
+    def open(self):
+        cache.set(f'{self._key}:open', 1, self.recovery_timeout)
+        # Remember the circuit was opened, so a failed trial opens it again
+        cache.set(f'{self._key}:tripped', 1, self.recovery_timeout + self.failure_window)
+        cache.delete_many([f'{self._key}:failures', f'{self._key}:trial'])
+
+    def record_failure(self):
+        failures_key = f'{self._key}:failures'
+        cache.add(failures_key, 0, self.failure_window)
+        failures = cache.incr(failures_key)
+        if failures >= self.failure_threshold or cache.get(f'{self._key}:tripped') is not None:
+            self.open()
+
+    def record_success(self, has_state=True):
+        # Healthy calls leave no state behind, so there is nothing to delete
+        if has_state:
+            cache.delete_many([f'{self._key}:failures', f'{self._key}:tripped', f'{self._key}:trial'])
+
+    def before_call(self):
+        """Read the state with one cache query. Raise `CircuitBreakerError`
+           if the circuit is open or another call is already the trial.
+           Return whether there is any state for the `record_success` to clear."""
+        open_key, tripped_key = f'{self._key}:open', f'{self._key}:tripped'
+        state = cache.get_many([open_key, tripped_key, f'{self._key}:failures'])
+        if open_key in state:
+            raise CircuitBreakerError(f'{self.name} circuit is open.')
+        # The recovery timeout has passed - only the call that adds the trial key probes the service
+        if tripped_key in state and not cache.add(f'{self._key}:trial', 1, self.recovery_timeout):
+            raise CircuitBreakerError(f'{self.name} circuit is half-open.')
+        return bool(state)
+
+    def call(self, func, *args, **kwargs):
+        """Call the function, unless the circuit is open. Raise
+           `CircuitBreakerError` if it's open or the call fails
+           with one of the `errors`."""
+        has_state = self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except self.errors as e:
+            self.record_failure()
+            raise CircuitBreakerError(f'{self.name} call failed.') from e
+        self.record_success(has_state)
+        return result
+
+    async def acall(self, func, *args, **kwargs):
+        """Async version of the `call`, for coroutine functions."""
+        has_state = self.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except self.errors as e:
+            self.record_failure()
+            raise CircuitBreakerError(f'{self.name} call failed.') from e
+        self.record_success(has_state)
+        return result
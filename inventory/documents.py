@@ -1,16 +1,33 @@
+from itertools import islice
+
 from django_elasticsearch_dsl import Document, fields
 from django_elasticsearch_dsl.registries import registry
 
-from inventory.models import Product, ProductAttributeValue, ProductAttribute, Category, Brand
+from inventory.models import (Product,
+                              ProductAttributeValue,
+                              ProductAttribute,
+                              Category,
+                              Brand,
+                              load_category_ancestors)
 
 
 @registry.register_document
 class ProductDocument(Document):
     """Document for the product object."""
+    name = fields.TextField(fields={'raw': fields.KeywordField()})
     categories = fields.TextField(attr='categories_indexing')
     attributes = fields.TextField(attr='attribute_values_indexing')
     brand = fields.TextField(attr='brand_indexing')
 
+    # Fields used only for filtering
+    brand_id = fields.IntegerField(attr='brand_id')
+    category_ids = fields.IntegerField(attr='category_ids_indexing')
+    attribute_value_ids = fields.IntegerField(attr='attribute_value_ids_indexing')
+    in_stock = fields.BooleanField()
+
+    # Used only for the autocomplete
+    suggest = fields.CompletionField(attr='suggest_indexing')
+
     class Index:
         name = 'product'
         settings = {
@@ -22,6 +39,28 @@ class ProductDocument(Document):
         model = Product
         fields = [
             'id',
-            'name',
-            'description'
+            'description',
+            # Used for sorting and filtering by the lowest price
+            'min_price',
+            'units_sold',
+            'created_at',
         ]
+        queryset_pagination = 500
+
+    def get_queryset(self):
+        """Return products with all the indexed data prefetched."""
+        return Product.objects.for_indexing()
+
+    def _get_actions(self, object_list, action):
+        """Load ancestors of categories with one query per chunk
+           of products, instead of one query per product."""
+        if action == 'delete':
+            yield from super()._get_actions(object_list, action)
+            return
+        products = iter(object_list)
+        while True:
+            chunk = list(islice(products, self.django.queryset_pagination))
+            if not chunk:
+                return
+            load_category_ancestors(chunk)
+            yield from super()._get_actions(chunk, action)
@@ -0,0 +1,163 @@
+"""
+Bulk indexing of products in Elasticsearch.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+from elasticsearch.helpers import bulk, parallel_bulk
+from kombu.exceptions import OperationalError
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from .documents import ProductDocument
+from .models import Product, load_category_ancestors
+
+INDEX_QUEUE_KEY = 'inventory:product-index-queue'
+INDEX_FLUSH_SCHEDULED_KEY = 'inventory:product-index-flush-scheduled'
+REINDEX_RECORDING_KEY = 'inventory:product-reindex-recording'
+REINDEX_CHANGES_KEY = 'inventory:product-reindex-changes'
+REINDEX_RECORDING_TIMEOUT = 60 * 60 * 24
+
+logger = logging.getLogger(__name__)
+
+
+def iter_product_chunks(queryset=None, chunk_size=500):
+    """Yield lists of products loaded with `for_indexing`. Chunks are
+       read by ranges of ids, so there are no OFFSET scans, and each
+       chunk costs the same, fixed number of queries."""
+    if queryset is None:
+        queryset = Product.objects.all()
+    queryset = queryset.for_indexing().order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        load_category_ancestors(chunk)
+        yield chunk
+        last_id = chunk[-1].id
+
+
+def build_product_actions(index_name, queryset=None, chunk_size=500):
+    """Yield bulk `index` actions for products. Documents are prepared
+       from prefetched data, without any per-product queries."""
+    document = ProductDocument()
+    for chunk in iter_product_chunks(queryset, chunk_size):
+        for product in chunk:
+            yield {
+                '_op_type': 'index',
+                '_index': index_name,
+                '_id': document.generate_id(product),
+                '_source': document.prepare(product)
+            }
+
+
+def bulk_index(client, actions, workers=4, chunk_size=500):
+    """Send actions to Elasticsearch with the bulk helper, using a pool
+       of `workers` threads. Return the numbers of indexed and failed documents."""
+    indexed, failed = 0, 0
+    for ok, _ in parallel_bulk(
+        client,
+        actions,
+        thread_count=workers,
+        chunk_size=chunk_size,
+        raise_on_error=False
+    ):
+        if ok:
+            indexed += 1
+        else:
+            failed += 1
+    return indexed, failed
+
+
+def index_products(product_ids):
+    """Index products with the given ids in one bulk request.
+       Documents of products that no longer exist are deleted."""
+    product_ids = set(product_ids)
+    index_name = ProductDocument._index._name
+    queryset = Product.objects.filter(id__in=product_ids)
+    actions = list(build_product_actions(index_name, queryset=queryset))
+    indexed_ids = {action['_id'] for action in actions}
+    actions += [
+        {'_op_type': 'delete', '_index': index_name, '_id': pk}
+        for pk in product_ids - indexed_ids
+    ]
+    # Deleting a document that was never indexed is not an error
+    return bulk(ProductDocument._get_connection(), actions, ignore_status=404)
+
+
+def enqueue_products(product_ids):
+    """Queue products for indexing, once the current transaction commits.
+       Ids are kept in a Redis set, so a product changed many times is
+       indexed once, and a single flush task is scheduled per batch -
+       after PRODUCT_INDEX_BATCH_DELAY_MS, or right away when
+       PRODUCT_INDEX_BATCH_SIZE products are waiting.
+       The change is already committed when the flush is scheduled, so
+       broker and Redis errors are only logged - the ids stay queued
+       in Redis (if it's up) and are indexed by the next flush."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+
+    def enqueue():
+        from .tasks import index_queued_products_task
+
+        try:
+            redis = get_redis_connection('default')
+            # Recorded before queueing, so a flush that could still
+            # write to the previous index is always recorded
+            if redis.exists(REINDEX_RECORDING_KEY):
+                redis.sadd(REINDEX_CHANGES_KEY, *product_ids)
+            redis.sadd(INDEX_QUEUE_KEY, *product_ids)
+            if redis.scard(INDEX_QUEUE_KEY) >= settings.PRODUCT_INDEX_BATCH_SIZE:
+                index_queued_products_task.delay()
+            elif redis.set(INDEX_FLUSH_SCHEDULED_KEY, 1, nx=True, px=settings.PRODUCT_INDEX_BATCH_DELAY_MS):
+                index_queued_products_task.apply_async(
+                    countdown=settings.PRODUCT_INDEX_BATCH_DELAY_MS / 1000
+                )
+        except (OperationalError, RedisConnectionError) as e:
+            logger.warning(f'{e} error occurred while scheduling indexing of queued products')
+
+    transaction.on_commit(enqueue)
+
+
+def start_recording_changes():
+    """Record ids of products queued from now on, until
+       `stop_recording_changes`. While a reindex loads products into
+       a new index, queued changes are still written to the old one."""
+    redis = get_redis_connection('default')
+    redis.delete(REINDEX_CHANGES_KEY)
+    redis.set(REINDEX_RECORDING_KEY, 1, ex=REINDEX_RECORDING_TIMEOUT)
+
+
+def stop_recording_changes():
+    """Stop recording and return ids of products queued meanwhile."""
+    pipeline = get_redis_connection('default').pipeline()
+    pipeline.delete(REINDEX_RECORDING_KEY)
+    pipeline.smembers(REINDEX_CHANGES_KEY)
+    pipeline.delete(REINDEX_CHANGES_KEY)
+    _, product_ids, _ = pipeline.execute()
+    return sorted(int(pk) for pk in product_ids)
+
+
+def index_queued_products():
+    """Index all the queued products in batches of PRODUCT_INDEX_BATCH_SIZE.
+       Return the number of indexed products."""
+    redis = get_redis_connection('default')
+    # Let changes made from now on schedule the next flush
+    redis.delete(INDEX_FLUSH_SCHEDULED_KEY)
+    total = 0
+    while True:
+        product_ids = [
+            int(pk) for pk in redis.spop(INDEX_QUEUE_KEY, settings.PRODUCT_INDEX_BATCH_SIZE)
+        ]
+        if not product_ids:
+            return total
+        try:
+            index_products(product_ids)
+        except Exception:
+            # Put the products back, so they are indexed by the next flush
+            redis.sadd(INDEX_QUEUE_KEY, *product_ids)
+            raise
+        total += len(product_ids)
@@ -0,0 +1,68 @@
+"""
+Building and reading the denormalized product listing rows.
+"""
+from .models import Product, ProductListingRow, load_category_ancestors
+from .serializers import ProductSerializer
+
+LISTING_ROW_FIELDS = [
+    'min_price',
+    'image',
+    'brand_name',
+    'attribute_value_ids',
+    'category_ids',
+    'payload',
+    'updated_at',
+]
+
+
+def build_listing_row(product):
+    """Build (without saving) the listing row of a product. The product
+       should be loaded with `for_listing` and prefetched categories."""
+    prices = [inventory.price for inventory in product.product_inventories]
+    image = product.image
+    payload = ProductSerializer(product).data
+    # The price is stored in its own column as a decimal
+    payload.pop('price')
+
+    return ProductListingRow(
+        product=product,
+        min_price=min(prices) if prices else None,
+        image=image.image.name if image else '',
+        brand_name=product.brand.name,
+        attribute_value_ids=sorted({attr.id for attr in product.all_attribute_values}),
+        category_ids=sorted(category.id for category in product.categories.all()),
+        payload=payload
+    )
+
+
+def refresh_listing_rows(product_ids):
+    """Create or update listing rows of products with the given ids.
+       Costs a fixed number of queries however many products there are."""
+    products = list(Product.objects.filter(
+        id__in=list(product_ids)
+    ).for_listing().prefetch_related('categories'))
+    load_category_ancestors(products)
+    rows = [build_listing_row(product) for product in products]
+    if rows:
+        ProductListingRow.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=LISTING_ROW_FIELDS
+        )
+    return rows
+
+
+def get_listing_rows(products):
+    """Return listing rows of the given products in the same order.
+       Rows that do not exist yet are built on the way."""
+    return get_listing_rows_by_ids([product.id for product in products])
+
+
+def get_listing_rows_by_ids(product_ids):
+    """Return listing rows of products with the given ids in the same order."""
+    rows = ProductListingRow.objects.in_bulk(product_ids)
+    missing_ids = [pk for pk in product_ids if pk not in rows]
+    if missing_ids:
+        rows.update({row.product_id: row for row in refresh_listing_rows(missing_ids)})
+    return [rows[pk] for pk in product_ids if pk in rows]
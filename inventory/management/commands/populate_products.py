@@ -39,11 +39,9 @@ class Command(BaseCommand):
                     description=' '.join(book_description),
                     brand=random.choice(brands)
                 )
-                product.categories.add(
-                    category,
-                    category.parent,
-                    category.parent.parent
-                )
+                # Only the leaf category, products are listed in ancestor
+                # categories by their MPTT bounds
+                product.categories.add(category)
                 product.save()
             except IntegrityError:
                 # It can happen if the title already exists.
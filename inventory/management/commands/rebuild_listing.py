@@ -0,0 +1,34 @@
+"""
+Django command to rebuild the denormalized product listing rows.
+"""
+from django.core.management import BaseCommand
+
+from inventory.listing import refresh_listing_rows
+from inventory.models import Product, ProductListingRow
+
+
+class Command(BaseCommand):
+    """Django command to rebuild listing rows of all products."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of products rebuilt per batch.'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+
+        for start in range(0, len(product_ids), chunk_size):
+            refresh_listing_rows(product_ids[start:start + chunk_size])
+
+        # Rows of deleted products are removed by the cascade, but the table
+        # could have been modified by hand - remove anything left behind.
+        ProductListingRow.objects.exclude(product_id__in=product_ids).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Listing rows of {len(product_ids)} products rebuilt successfully.'
+        ))
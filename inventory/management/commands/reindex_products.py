@@ -0,0 +1,119 @@
+"""
+Django command to reindex all products in Elasticsearch with zero downtime.
+"""
+import time
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from inventory.documents import ProductDocument
+from inventory.indexing import (build_product_actions,
+                                bulk_index,
+                                enqueue_products,
+                                start_recording_changes,
+                                stop_recording_changes)
+
+
+class Command(BaseCommand):
+    """Django command to build a new, versioned product index with
+       the bulk helper and swap it behind the index alias."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of products read from the database and sent in one bulk request.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of threads sending bulk requests.'
+        )
+        parser.add_argument(
+            '--keep-old',
+            action='store_true',
+            help='Do not delete the previous indices after the swap.'
+        )
+
+    def handle(self, *args, **options):
+        client = ProductDocument._get_connection()
+        alias = ProductDocument._index._name
+        new_index_name = f'{alias}-{timezone.now():%Y%m%d%H%M%S}'
+
+        # Create the new index with the document's settings and mappings.
+        # Refreshing is turned off while loading data - it is costly
+        # and nobody reads from the new index yet.
+        index = ProductDocument._index.clone(name=new_index_name)
+        index.create(using=client)
+        client.indices.put_settings(
+            index=new_index_name,
+            body={'index': {'refresh_interval': '-1'}}
+        )
+
+        # Changes queued during the load are written through the alias
+        # to the old index, they are queued again after the swap
+        start_recording_changes()
+        self.stdout.write(f'Indexing products into {new_index_name}...')
+        start = time.monotonic()
+        actions = build_product_actions(new_index_name, chunk_size=options['chunk_size'])
+        try:
+            indexed, failed = bulk_index(
+                client,
+                actions,
+                workers=options['workers'],
+                chunk_size=options['chunk_size']
+            )
+        except Exception:
+            # Do not leave a half-filled index behind, the alias was not swapped yet
+            stop_recording_changes()
+            client.indices.delete(index=new_index_name)
+            raise
+        elapsed = time.monotonic() - start
+
+        client.indices.put_settings(
+            index=new_index_name,
+            body={'index': {'refresh_interval': None}}
+        )
+        client.indices.refresh(index=new_index_name)
+
+        if failed:
+            stop_recording_changes()
+            client.indices.delete(index=new_index_name)
+            self.stdout.write(self.style.ERROR(
+                f'{failed} products failed to index. The new index was deleted, '
+                f'{alias} still points to the old one.'
+            ))
+            return
+
+        old_indices = self._swap_alias(client, alias, new_index_name)
+        enqueue_products(stop_recording_changes())
+        if old_indices and not options['keep_old']:
+            client.indices.delete(index=','.join(old_indices))
+
+        rate = indexed / elapsed if elapsed else indexed
+        self.stdout.write(self.style.SUCCESS(
+            f'{indexed} products indexed in {elapsed:.2f}s ({rate:.0f} docs/s). '
+            f'{alias} now points to {new_index_name}.'
+        ))
+
+    @staticmethod
+    def _swap_alias(client, alias, new_index_name):
+        """Point the alias to the new index in one atomic request and
+           return names of indices the alias pointed to before."""
+        actions = [{'add': {'index': new_index_name, 'alias': alias}}]
+        old_indices = []
+        if client.indices.exists_alias(name=alias):
+            old_indices = list(client.indices.get_alias(name=alias))
+            actions += [
+                {'remove': {'index': old_index, 'alias': alias}}
+                for old_index in old_indices
+            ]
+        elif client.indices.exists(index=alias):
+            # An index created before aliases were used has the alias' name,
+            # it has to be removed in the same request as the alias is added
+            actions.append({'remove_index': {'index': alias}})
+
+        client.indices.update_aliases(body={'actions': actions})
+        return old_indices
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.7 on 2026-10-17 02:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_alter_product_brand_alter_product_categories'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductListingRow',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing_row', serialize=False, to='inventory.product')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True)),
+                ('image', models.CharField(blank=True, max_length=255, verbose_name='primary image path')),
+                ('brand_name', models.CharField(max_length=255)),
+                ('attribute_value_ids', models.JSONField(default=list)),
+                ('category_ids', models.JSONField(default=list)),
+                ('payload', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-17 02:41
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def remove_ancestor_category_links(apps, schema_editor):
+    """Products are listed in ancestor categories by the MPTT bounds,
+       so links to ancestors of another linked category are redundant."""
+    Product = apps.get_model('inventory', 'Product')
+    ProductCategory = Product.categories.through
+    descendant_links = ProductCategory.objects.filter(
+        product_id=OuterRef('product_id'),
+        category__tree_id=OuterRef('category__tree_id'),
+        category__lft__gt=OuterRef('category__lft'),
+        category__rght__lt=OuterRef('category__rght'),
+    )
+    ProductCategory.objects.filter(Exists(descendant_links)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_created_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['tree_id', 'lft', 'rght'], name='category_tree_bounds_idx'),
+        ),
+        migrations.RunPython(remove_ancestor_category_links, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.1.7 on 2026-10-17 02:42
+
+from django.db import migrations, models
+from django.db.models import Exists, Max, Min, OuterRef, Subquery
+
+
+def backfill_price_and_stock(apps, schema_editor):
+    Product = apps.get_model('inventory', 'Product')
+    ProductInventory = apps.get_model('inventory', 'ProductInventory')
+    Stock = apps.get_model('inventory', 'Stock')
+    inventories = ProductInventory.objects.filter(
+        product=OuterRef('pk')
+    ).order_by().values('product')
+    Product.objects.update(
+        min_price=Subquery(inventories.annotate(min_price=Min('price')).values('min_price')),
+        max_price=Subquery(inventories.annotate(max_price=Max('price')).values('max_price')),
+        in_stock=Exists(Stock.objects.filter(
+            product_inventory__product=OuterRef('pk'),
+            units__gt=0
+        )),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0013_category_tree_bounds_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='in_stock',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='max_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=6, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='min_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=6, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['min_price', 'id'], name='product_min_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['max_price', 'id'], name='product_max_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['in_stock', 'min_price'], name='product_in_stock_price_idx'),
+        ),
+        migrations.RunPython(backfill_price_and_stock, migrations.RunPython.noop),
+    ]
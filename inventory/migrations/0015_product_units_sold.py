@@ -0,0 +1,36 @@
+# Generated by Django 4.1.7 on 2026-10-17 02:44
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_units_sold(apps, schema_editor):
+    Product = apps.get_model('inventory', 'Product')
+    Stock = apps.get_model('inventory', 'Stock')
+    units_sold = Stock.objects.filter(
+        product_inventory__product=OuterRef('pk')
+    ).order_by().values('product_inventory__product').annotate(
+        units_sold=Sum('units_sold')
+    ).values('units_sold')
+    Product.objects.update(units_sold=Coalesce(Subquery(units_sold), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0014_product_price_and_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='units_sold',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-units_sold', '-id'], name='product_units_sold_idx'),
+        ),
+        migrations.RunPython(backfill_units_sold, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.7 on 2026-10-17 02:50
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_search_vector(apps, schema_editor):
+    Product = apps.get_model('inventory', 'Product')
+    Brand = apps.get_model('inventory', 'Brand')
+    brand_name = Brand.objects.filter(pk=OuterRef('brand_id')).values('name')[:1]
+    Product.objects.update(search_vector=(
+        SearchVector('name', weight='A', config='english')
+        + SearchVector(Subquery(brand_name), weight='B', config='english')
+        + SearchVector('description', weight='C', config='english')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0015_product_units_sold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+        ),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+    ]
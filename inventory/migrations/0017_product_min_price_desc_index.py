@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-17 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0016_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(models.OrderBy(models.F('min_price'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='product_min_price_desc_idx'),
+        ),
+    ]
@@ -7,13 +7,21 @@ import random
 import string
 import uuid
 
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, SearchVectorField
+from django.db import models, transaction
+from django.db.models import Exists, F, Max, Min, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
 from mptt.models import MPTTModel, TreeForeignKey, TreeManyToManyField
 
 
+SEARCH_VECTOR_CONFIG = 'english'
+
+
 def image_file_path(instance, filename):
     """Generate file path for a new image."""
     ext = os.path.splitext(filename)[1]
@@ -53,6 +61,10 @@ class Category(MPTTModel):
     class Meta:
         verbose_name = _('product category')
         verbose_name_plural = _('product categories')
+        indexes = [
+            # Descendants of a category are looked up by its MPTT bounds
+            models.Index(fields=['tree_id', 'lft', 'rght'], name='category_tree_bounds_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -107,6 +119,112 @@ class ProductAttributeValue(models.Model):
         return f'{self.product_attribute}: {self.value}'
 
 
+def is_ancestor(ancestor, category):
+    """Return True if the `ancestor` is the category or one of its ancestors."""
+    return (ancestor.tree_id == category.tree_id
+            and ancestor.lft <= category.lft
+            and ancestor.rght >= category.rght)
+
+
+def load_category_ancestors(products):
+    """Set `categories_with_ancestors` of products (with prefetched
+       categories) with one query, found by the MPTT bounds."""
+    categories = {category.pk: category for product in products for category in product.categories.all()}
+    ancestors = []
+    if categories:
+        bounds = Q()
+        for category in categories.values():
+            bounds |= Q(tree_id=category.tree_id, lft__lte=category.lft, rght__gte=category.rght)
+        ancestors = list(Category.objects.filter(bounds).order_by('tree_id', 'lft'))
+    for product in products:
+        product.categories_with_ancestors = [
+            ancestor for ancestor in ancestors
+            if any(is_ancestor(ancestor, category) for category in product.categories.all())
+        ]
+
+
+class ProductQuerySet(models.QuerySet):
+    """Custom queryset for the product model."""
+
+    def for_listing(self):
+        """Load everything the product listing serializes up front - brand
+           with a join, inventories with their images and attribute values
+           with prefetches - so a page costs the same number of queries
+           no matter how many products it contains."""
+        inventories = ProductInventory.objects.order_by('id').prefetch_related(
+            Prefetch('images', queryset=ProductImage.objects.order_by('id')),
+            Prefetch(
+                'attribute_values',
+                queryset=ProductAttributeValue.objects.select_related('product_attribute')
+            )
+        )
+        return self.select_related('brand').prefetch_related(
+            Prefetch('inventories', queryset=inventories)
+        )
+
+    def in_category(self, category):
+        """Filter products linked to the category or any of its descendants.
+           Descendants are matched by the MPTT bounds of the category,
+           so products only need to be linked to their leaf category."""
+        links = self.model.categories.through.objects.filter(
+            product_id=OuterRef('pk'),
+            category__tree_id=category.tree_id,
+            category__lft__gte=category.lft,
+            category__rght__lte=category.rght,
+        )
+        return self.filter(Exists(links))
+
+    def refresh_price_and_stock(self):
+        """Recompute the denormalized `min_price`, `max_price`, `in_stock`
+           and `units_sold` of the products with one UPDATE."""
+        inventories = ProductInventory.objects.filter(
+            product=OuterRef('pk')
+        ).order_by().values('product')
+        stocks = Stock.objects.filter(product_inventory__product=OuterRef('pk'))
+        units_sold = stocks.order_by().values('product_inventory__product').annotate(
+            units_sold=Sum('units_sold')
+        ).values('units_sold')
+        return self.update(
+            min_price=Subquery(inventories.annotate(min_price=Min('price')).values('min_price')),
+            max_price=Subquery(inventories.annotate(max_price=Max('price')).values('max_price')),
+            in_stock=Exists(stocks.filter(units__gt=0)),
+            units_sold=Coalesce(Subquery(units_sold), 0),
+        )
+
+    def refresh_search_vector(self):
+        """Recompute the full text search vector (name, brand name
+           and description) of the products with one UPDATE."""
+        brand_name = Brand.objects.filter(pk=OuterRef('brand_id')).values('name')[:1]
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_VECTOR_CONFIG)
+            + SearchVector(Subquery(brand_name), weight='B', config=SEARCH_VECTOR_CONFIG)
+            + SearchVector('description', weight='C', config=SEARCH_VECTOR_CONFIG)
+        ))
+
+    def full_text_search(self, search_query):
+        """Search products with the Postgres full text search. It's a fallback
+           for when elasticsearch is unavailable. Products are annotated
+           with their `search_rank`."""
+        query = SearchQuery(search_query, search_type='websearch', config=SEARCH_VECTOR_CONFIG)
+        return self.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        )
+
+    def for_indexing(self):
+        """Load everything the `ProductDocument` indexes up front,
+           so preparing documents does not run any queries."""
+        inventories = ProductInventory.objects.order_by('id').prefetch_related(
+            Prefetch(
+                'attribute_values',
+                queryset=ProductAttributeValue.objects.select_related('product_attribute')
+            )
+        )
+        return self.select_related('brand').prefetch_related(
+            'categories',
+            Prefetch('inventories', queryset=inventories)
+        )
+
+
 class Product(models.Model):
     """Product details table."""
     name = models.CharField(max_length=200, unique=True)
@@ -124,27 +242,73 @@ class Product(models.Model):
         related_name='product'
     )
     is_active = models.BooleanField(default=True)
+    # Denormalized from the product inventories and their stock,
+    # kept up to date by signals (see `inventory.signals`)
+    min_price = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True, editable=False)
+    max_price = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True, editable=False)
+    in_stock = models.BooleanField(default=False, editable=False)
+    units_sold = models.PositiveIntegerField(default=0, editable=False)
+    # Kept up to date by signals, used when elasticsearch is unavailable
+    search_vector = SearchVectorField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Supports the keyset (cursor) pagination
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='product_created_at_id_idx'
+            ),
+            models.Index(fields=['min_price', 'id'], name='product_min_price_idx'),
+            # Products without a price come last in both directions
+            models.Index(
+                F('min_price').desc(nulls_last=True), F('id').desc(),
+                name='product_min_price_desc_idx'
+            ),
+            models.Index(fields=['max_price', 'id'], name='product_max_price_idx'),
+            models.Index(fields=['in_stock', 'min_price'], name='product_in_stock_price_idx'),
+            models.Index(fields=['-units_sold', '-id'], name='product_units_sold_idx'),
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+        ]
+
     @property
     def product_inventories(self):
+        """Product inventories of this product. Uses inventories
+           prefetched by `ProductQuerySet.for_listing` if there are any."""
+        if 'inventories' in getattr(self, '_prefetched_objects_cache', {}):
+            return self.inventories.all()
         return ProductInventory.objects.filter(product=self)
 
+    @property
+    def first_inventory(self):
+        """Return the first (the oldest) product inventory of this product."""
+        if 'inventories' in getattr(self, '_prefetched_objects_cache', {}):
+            inventories = self.inventories.all()
+            return inventories[0] if inventories else None
+        return self.product_inventories.first()
+
     @property
     def price(self):
         """Return the price of the first product inventory associated with this product."""
-        product_inventory = self.product_inventories.first()
+        product_inventory = self.first_inventory
         if product_inventory:
             return product_inventory.price
 
     @property
     def image(self):
-        product_inventory = self.product_inventories.first()
-        if product_inventory:
-            return ProductImage.objects.filter(
-                product_inventory=product_inventory
-            ).first()
+        """Return the first image of the first product inventory."""
+        product_inventory = self.first_inventory
+        if not product_inventory:
+            return None
+        if 'images' in getattr(product_inventory, '_prefetched_objects_cache', {}):
+            images = product_inventory.images.all()
+            return images[0] if images else None
+        return ProductImage.objects.filter(
+            product_inventory=product_inventory
+        ).first()
 
     @property
     def all_attribute_values(self):
@@ -169,13 +333,42 @@ class Product(models.Model):
     @property
     def categories_indexing(self):
         """Property for elasticsearch indexing. For search,
-           only names of categories are needed, not entire objects."""
-        return [category.name for category in self.categories.all()]
+           only names of categories (and their ancestors) are needed,
+           not entire objects."""
+        return [category.name for category in self.categories_with_ancestors]
+
+    @cached_property
+    def categories_with_ancestors(self):
+        """Categories of the product together with all their ancestors.
+           Use `load_category_ancestors` to load them for many products."""
+        return list(Category.objects.get_queryset_ancestors(self.categories.all(), include_self=True))
 
     @property
     def brand_indexing(self):
         return self.brand.name
 
+    @property
+    def suggest_indexing(self):
+        """Property for elasticsearch indexing. Names of the product,
+           its brand and categories are suggested by the autocomplete."""
+        return [
+            self.name,
+            self.brand.name,
+            *(category.name for category in self.categories_with_ancestors)
+        ]
+
+    @property
+    def category_ids_indexing(self):
+        """Property for elasticsearch indexing. Ids of categories
+           and their ancestors are needed for filtering by category."""
+        return [category.id for category in self.categories_with_ancestors]
+
+    @property
+    def attribute_value_ids_indexing(self):
+        """Property for elasticsearch indexing. Ids of attribute values
+           of all product inventories are needed for filtering by them."""
+        return sorted({attr.id for attr in self.all_attribute_values})
+
     def __str__(self):
         return self.name
 
@@ -228,9 +421,11 @@ class ProductInventory(models.Model):
         return f'{code}-{self.product.name[-3:]}-{brand_initials}-{time}'.upper()
 
     def save(self, *args, **kwargs):
-        """Save and generate unique code."""
+        """Save and generate unique code. The denormalized prices
+           of the product are updated in the same transaction."""
         self.code = self.generate_product_code()
-        return super().save(*args, **kwargs)
+        with transaction.atomic():
+            return super().save(*args, **kwargs)
 
     def __str__(self):
         return f'{self.product} {self.id}'
@@ -279,3 +474,41 @@ class Stock(models.Model):
             raise ValueError(f'There is not enough units in stock - {self.units} but tried to sell {n_of_sold_objects}')
         self.units_sold += n_of_sold_objects
         self.units -= n_of_sold_objects
+
+    def save(self, *args, **kwargs):
+        """Save the stock. The denormalized availability of
+           the product is updated in the same transaction."""
+        with transaction.atomic():
+            return super().save(*args, **kwargs)
+
+
+class ProductListingRow(models.Model):
+    """Denormalized read model for the product listing. Holds a product's
+       precomputed listing payload, so listing products does not need
+       to touch the related tables. Kept up to date by signals
+       (see `inventory.signals`)."""
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='listing_row'
+    )
+    min_price = models.DecimalField(
+        max_digits=6,
+        decimal_places=2,
+        null=True,
+        blank=True
+    )
+    image = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name=_('primary image path')
+    )
+    brand_name = models.CharField(max_length=255)
+    attribute_value_ids = models.JSONField(default=list)
+    category_ids = models.JSONField(default=list)
+    payload = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'listing row of product {self.product_id}'
@@ -0,0 +1,344 @@
+"""
+Searching products with Elasticsearch.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from elasticsearch.exceptions import TransportError
+from elasticsearch_dsl import A, Q
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .circuit_breaker import CircuitBreaker, CircuitBreakerError
+from .documents import ProductDocument
+from .models import Product
+
+SEARCH_FIELDS = [
+    'name',
+    'description',
+    'categories',
+    'brand',
+    'attributes'
+]
+
+# Facet name - indexed field it counts
+FACET_FIELDS = {
+    'attribute_values': 'attribute_value_ids',
+    'brands': 'brand_id',
+    'categories': 'category_ids',
+}
+FACET_SIZE = 500
+PRICE_HISTOGRAM_INTERVAL = 10
+SEARCH_RESULTS_CACHE_TIMEOUT = 60 * 5
+AUTOCOMPLETE_SIZE = 10
+AUTOCOMPLETE_MAX_LENGTH = 50
+AUTOCOMPLETE_CACHE_TIMEOUT = 60 * 10
+
+search_circuit_breaker = CircuitBreaker(
+    'elasticsearch',
+    errors=(TransportError,),
+    failure_threshold=settings.SEARCH_CIRCUIT_BREAKER_FAILURES,
+    recovery_timeout=settings.SEARCH_CIRCUIT_BREAKER_RECOVERY_TIMEOUT,
+)
+
+
+class SearchUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Search is temporarily unavailable, try again later.'
+    default_code = 'search_unavailable'
+
+
+# Model field - indexed field to sort by, if they differ
+SORT_FIELDS = {
+    'name': 'name.raw',
+}
+
+
+def build_sort(ordering):
+    """Translate the ordering of products (model fields,
+       like `-created_at`) to an elasticsearch sort."""
+    sort = []
+    for field in ordering:
+        descending = field.startswith('-')
+        field = field.lstrip('-')
+        sort.append(f'{"-" if descending else ""}{SORT_FIELDS.get(field, field)}')
+    return sort
+
+
+def build_text_query(search_query):
+    """Return the full text query for products, or a query
+       matching all products if there is nothing to search for."""
+    if not search_query:
+        return Q('match_all')
+    return Q(
+        'multi_match',
+        query=search_query,
+        fields=SEARCH_FIELDS,
+        fuzziness='auto',
+        minimum_should_match=1
+    )
+
+
+def build_filter_clauses(category_ids=None, brand_ids=None,
+                         attribute_value_ids=None, price_range=None, in_stock=False):
+    """Return a dict of filter clauses for the given filters, keyed
+       by the same names as facets, so facets can skip their own filter."""
+    filters = {}
+    if category_ids:
+        filters['categories'] = Q('terms', category_ids=category_ids)
+    if brand_ids:
+        filters['brands'] = Q('terms', brand_id=brand_ids)
+    if attribute_value_ids:
+        filters['attribute_values'] = Q('terms', attribute_value_ids=attribute_value_ids)
+    if price_range:
+        start_price, end_price = price_range
+        # Products are filtered by the lowest price, the same as in SQL
+        filters['prices'] = Q('range', min_price={'gte': start_price, 'lte': end_price})
+    if in_stock:
+        filters['in_stock'] = Q('term', in_stock=True)
+    return filters
+
+
+def build_product_search(search_query, category_ids=None, brand_ids=None,
+                         attribute_value_ids=None, price_range=None, in_stock=False,
+                         ordering=None):
+    """Return a search for products matching the query. The full text query
+       scores the products, all the filters are run by Elasticsearch
+       as non-scoring `filter` clauses. Products are sorted by relevance,
+       unless the ordering (model fields) is given."""
+    filters = build_filter_clauses(
+        category_ids=category_ids,
+        brand_ids=brand_ids,
+        attribute_value_ids=attribute_value_ids,
+        price_range=price_range,
+        in_stock=in_stock
+    )
+
+    # Only ids of products are needed
+    search = ProductDocument.search().query(
+        Q('bool', must=[build_text_query(search_query)], filter=list(filters.values()))
+    ).source(False)
+    if ordering:
+        search = search.sort(*build_sort(ordering))
+    return search
+
+
+def build_product_facets_search(search_query=None, category_ids=None, brand_ids=None,
+                                attribute_value_ids=None, price_range=None, in_stock=False):
+    """Return a search that counts products for every filter value in one
+       aggregation request. The category from the URL and the availability
+       narrow all the counts, other filters narrow counts of all facets
+       except their own, so users can still see (and select) other values
+       of a filter they have already used."""
+    filters = build_filter_clauses(
+        brand_ids=brand_ids,
+        attribute_value_ids=attribute_value_ids,
+        price_range=price_range
+    )
+    base_filters = list(build_filter_clauses(category_ids=category_ids, in_stock=in_stock).values())
+    search = ProductDocument.search().query(
+        Q('bool', must=[build_text_query(search_query)], filter=base_filters)
+    ).extra(size=0, track_total_hits=True)
+    # post_filter narrows the total count, but not the aggregations
+    if filters:
+        search = search.post_filter(Q('bool', filter=list(filters.values())))
+
+    def other_filters(facet):
+        return Q('bool', filter=[f for name, f in filters.items() if name != facet])
+
+    for facet, field in FACET_FIELDS.items():
+        search.aggs.bucket(facet, A('filter', other_filters(facet))).bucket(
+            'values', 'terms', field=field, size=FACET_SIZE
+        )
+    search.aggs.bucket('prices', A('filter', other_filters('prices'))).bucket(
+        'values', 'histogram', field='min_price', interval=PRICE_HISTOGRAM_INTERVAL, min_doc_count=1
+    )
+    return search
+
+
+def get_product_facets(search):
+    """Execute the facets search and return counts of products for every
+       attribute value, brand, category and price range."""
+    try:
+        response = search_circuit_breaker.call(
+            search.params(request_timeout=settings.SEARCH_TIMEOUT_BUDGET).execute
+        )
+    except CircuitBreakerError:
+        raise SearchUnavailable()
+    aggregations = response.aggregations
+    facets = {
+        facet: [
+            {'id': bucket.key, 'count': bucket.doc_count}
+            for bucket in aggregations[facet]['values'].buckets
+        ]
+        for facet in FACET_FIELDS
+    }
+    facets['prices'] = [
+        {
+            'min_price': bucket.key,
+            'max_price': bucket.key + PRICE_HISTOGRAM_INTERVAL,
+            'count': bucket.doc_count
+        }
+        for bucket in aggregations['prices']['values'].buckets
+    ]
+    facets['count'] = response.hits.total.value
+    return facets
+
+
+def get_async_client():
+    """Return a new `AsyncElasticsearch` client. Its connections belong
+       to the running event loop (e.g. one per request under WSGI), so it
+       has to be closed before the request ends, best with `async with`.
+       The async client needs the optional aiohttp package."""
+    try:
+        from elasticsearch import AsyncElasticsearch
+    except ImportError:
+        raise ImproperlyConfigured('The async product views need the aiohttp package to be installed.')
+    return AsyncElasticsearch(**settings.ELASTICSEARCH_DSL['default'])
+
+
+async def async_search_products(search, start, stop):
+    """Execute the product search with the async client and return
+       the total count and ids of products hit in the given slice.
+       Both come from one request. The client is closed afterwards.
+       Raises `CircuitBreakerError` if elasticsearch is unavailable."""
+    body = search[start:stop].extra(track_total_hits=True).to_dict()
+    async with get_async_client() as client:
+        response = await search_circuit_breaker.acall(
+            client.search,
+            index=ProductDocument._index._name,
+            body=body,
+            request_timeout=settings.SEARCH_TIMEOUT_BUDGET
+        )
+    hits = response['hits']
+    return hits['total']['value'], [int(hit['_id']) for hit in hits['hits']]
+
+
+def normalize_prefix(prefix):
+    """Lowercase the prefix and collapse whitespace, so prefixes
+       typed differently share suggestions (and cache entries)."""
+    return ' '.join(prefix.lower().split())[:AUTOCOMPLETE_MAX_LENGTH]
+
+
+def build_autocomplete_search(prefix):
+    """Return a search suggesting product names, brands and categories
+       starting with the prefix. It uses only the completion suggester,
+       which is served from memory, so no documents are searched."""
+    return ProductDocument.search().suggest(
+        'suggestions',
+        prefix,
+        completion={'field': 'suggest', 'size': AUTOCOMPLETE_SIZE, 'skip_duplicates': True}
+    ).source(False).extra(size=0)
+
+
+def get_autocomplete_suggestions(prefix):
+    """Return at most `AUTOCOMPLETE_SIZE` suggestions for the prefix,
+       cached for `AUTOCOMPLETE_CACHE_TIMEOUT` by the normalized prefix.
+       There are no suggestions while elasticsearch is unavailable."""
+    prefix = normalize_prefix(prefix)
+    if not prefix:
+        return []
+
+    def suggest():
+        search = build_autocomplete_search(prefix).params(request_timeout=settings.SEARCH_TIMEOUT_BUDGET)
+        response = search_circuit_breaker.call(search.execute)
+        return [option.text for option in response.suggest.suggestions[0].options]
+
+    key = f'inventory:autocomplete:{hashlib.md5(prefix.encode()).hexdigest()}'
+    try:
+        return cache.get_or_set(key, suggest, AUTOCOMPLETE_CACHE_TIMEOUT)
+    except CircuitBreakerError:
+        # Suggestions are not essential, nothing to fall back to
+        return []
+
+
+class ProductSearchResults:
+    """Lazy results of a product search. Django's paginator counts them
+       and slices them for a page, so only hits of the requested page are
+       fetched from Elasticsearch (with `from` and `size`) and only
+       products of that page are fetched from the database, in the order
+       of the hits. Counts and ids of hits are cached for a short time
+       under the search body, so repeated searches skip Elasticsearch.
+
+       All elasticsearch requests share one timeout budget and go through
+       the circuit breaker. If elasticsearch is unavailable, results come
+       from the `fallback` queryset, if it is given."""
+
+    def __init__(self, search, queryset=None, cache_timeout=SEARCH_RESULTS_CACHE_TIMEOUT,
+                 fallback=None, timeout_budget=None):
+        self.search = search
+        self.queryset = Product.objects.all() if queryset is None else queryset
+        self.cache_timeout = cache_timeout
+        self.fallback = fallback
+        self.timeout_budget = settings.SEARCH_TIMEOUT_BUDGET if timeout_budget is None else timeout_budget
+        body = json.dumps(search.to_dict(), sort_keys=True, default=str)
+        self.cache_key = f'inventory:search:{hashlib.md5(body.encode()).hexdigest()}'
+        self._count = None
+        self._deadline = None
+        self._fallback_results = None
+
+    def call_search(self, func):
+        """Call `func` with the search limited to the time left
+           of the budget, through the circuit breaker."""
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self.timeout_budget
+        timeout = self._deadline - time.monotonic()
+        if timeout <= 0:
+            raise CircuitBreakerError('The search timeout budget is used up.')
+        return search_circuit_breaker.call(func, self.search.params(request_timeout=timeout))
+
+    @property
+    def used_fallback(self):
+        return self._fallback_results is not None
+
+    def get_fallback_results(self):
+        if self.fallback is None:
+            raise SearchUnavailable()
+        if self._fallback_results is None:
+            self._fallback_results = self.fallback()
+        return self._fallback_results
+
+    def count(self):
+        if self._count is None:
+            try:
+                self._count = cache.get_or_set(
+                    f'{self.cache_key}:count',
+                    lambda: self.call_search(lambda search: search.count()),
+                    self.cache_timeout
+                )
+            except CircuitBreakerError:
+                self._count = self.get_fallback_results().count()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def get_hit_ids(self, item):
+        """Return ids of products hit in the given slice."""
+        return cache.get_or_set(
+            f'{self.cache_key}:{item.start}:{item.stop}',
+            lambda: self.call_search(
+                lambda search: [int(hit.meta.id) for hit in search[item].execute()]
+            ),
+            self.cache_timeout
+        )
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        # Once fallen back, the count and pages come from the same results
+        if not self.used_fallback:
+            try:
+                ids = self.get_hit_ids(item)
+            except CircuitBreakerError:
+                # The count came from elasticsearch, count the fallback results instead
+                self._count = self.get_fallback_results().count()
+            else:
+                products = self.queryset.in_bulk(ids)
+                # Keep the order of the hits
+                return [products[pk] for pk in ids if pk in products]
+        return list(self.get_fallback_results()[item])
@@ -12,7 +12,8 @@ from .models import (Category,
                      Product,
                      ProductInventory,
                      Stock,
-                     ProductImage)
+                     ProductImage,
+                     ProductListingRow)
 
 
 class ChildCategorySerializer(serializers.ModelSerializer):
@@ -34,6 +35,19 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only = True
 
 
+class CategoryTreeSerializer(serializers.Serializer):
+    """Serializer for a node of the category tree."""
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    slug = serializers.SlugField()
+    is_active = serializers.BooleanField()
+    level = serializers.IntegerField()
+    children = serializers.ListField(
+        child=serializers.DictField(),
+        help_text='Nested nodes of the same format.'
+    )
+
+
 class BrandSerializer(serializers.ModelSerializer):
     """Serializer for the brand model."""
 
@@ -121,10 +135,49 @@ class ProductSerializer(serializers.ModelSerializer):
         read_only = True
 
 
+class ProductListingRowSerializer(serializers.ModelSerializer):
+    """Serializer for the precomputed product listing rows. Returns
+       the same data as the `ProductSerializer`, but without touching
+       any table other than the listing rows one."""
+    id = serializers.IntegerField(source='product_id')
+    name = serializers.CharField(source='payload.name')
+    slug = serializers.CharField(source='payload.slug')
+    brand = serializers.ReadOnlyField(source='payload.brand')
+    price = serializers.DecimalField(
+        source='min_price',
+        max_digits=6,
+        decimal_places=2,
+        coerce_to_string=False
+    )
+    image = serializers.SerializerMethodField()
+    all_attribute_values = serializers.ReadOnlyField(source='payload.all_attribute_values')
+
+    class Meta:
+        model = ProductListingRow
+        fields = [
+            'id',
+            'name',
+            'slug',
+            'brand',
+            'price',
+            'image',
+            'all_attribute_values'
+        ]
+        read_only = True
+
+    def get_image(self, row):
+        """Return the stored image with an absolute URL, like the `ImageSerializer` does."""
+        image = row.payload.get('image')
+        request = self.context.get('request')
+        if image and request:
+            image = {**image, 'image': request.build_absolute_uri(image['image'])}
+        return image
+
+
 class ProductDetailSerializer(serializers.ModelSerializer):
     """serializer for the product details."""
     brand = BrandSerializer()
-    categories = SimpleCategorySerializer(many=True)
+    categories = SimpleCategorySerializer(many=True, source='categories_with_ancestors')
     product_inventories = ProductInventorySerializer(many=True)
 
     class Meta:
@@ -152,6 +205,33 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         return response
 
 
+class FacetBucketSerializer(serializers.Serializer):
+    """Serializer for a number of products with a given filter value."""
+    id = serializers.IntegerField()
+    count = serializers.IntegerField()
+
+
+class PriceFacetBucketSerializer(serializers.Serializer):
+    """Serializer for a number of products in a given price range."""
+    min_price = serializers.FloatField()
+    max_price = serializers.FloatField()
+    count = serializers.IntegerField()
+
+
+class ProductFacetsSerializer(serializers.Serializer):
+    """Serializer for counts of products for every filter value."""
+    count = serializers.IntegerField()
+    attribute_values = FacetBucketSerializer(many=True)
+    brands = FacetBucketSerializer(many=True)
+    categories = FacetBucketSerializer(many=True)
+    prices = PriceFacetBucketSerializer(many=True)
+
+
+class AutocompleteSerializer(serializers.Serializer):
+    """Serializer for the autocomplete suggestions."""
+    suggestions = serializers.ListField(child=serializers.CharField())
+
+
 class ProductSearchSerializer(DocumentSerializer):
     """Serializer only for handling searching products."""
 
@@ -0,0 +1,282 @@
+"""
+Signal handlers for the inventory app. They keep the denormalized
+product listing rows, cached responses and the elasticsearch index
+in sync with the models they are built from.
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django_elasticsearch_dsl.apps import DEDConfig
+from django_elasticsearch_dsl.signals import BaseSignalProcessor
+
+from .cache import invalidate_tags
+from .categories import bump_category_tree_version
+from .indexing import enqueue_products
+from .listing import refresh_listing_rows
+from .models import (Category,
+                     Brand,
+                     ProductAttribute,
+                     ProductAttributeValue,
+                     Product,
+                     ProductInventory,
+                     ProductImage,
+                     ProductListingRow,
+                     Stock)
+from .stock import refresh_products_price_and_stock
+
+
+def get_affected_product_ids(instance):
+    """Return ids of products whose data depends on the given instance."""
+    if isinstance(instance, Product):
+        return [instance.pk]
+    if isinstance(instance, ProductInventory):
+        return [instance.product_id]
+    if isinstance(instance, (ProductImage, Stock)):
+        return list(ProductInventory.objects.filter(
+            pk=instance.product_inventory_id
+        ).values_list('product_id', flat=True))
+    if isinstance(instance, Brand):
+        lookup = {'brand': instance}
+    elif isinstance(instance, ProductAttributeValue):
+        lookup = {'inventories__attribute_values': instance}
+    elif isinstance(instance, ProductAttribute):
+        lookup = {'inventories__attribute_values__product_attribute': instance}
+    elif isinstance(instance, Category):
+        # Products of descendant categories are indexed with their ancestors
+        lookup = {'categories__in': instance.get_descendants(include_self=True)}
+    else:
+        return []
+    return list(Product.objects.filter(**lookup).values_list('id', flat=True).distinct())
+
+
+def get_category_tags(categories):
+    """Return tags of product lists of the categories and all their ancestors."""
+    ancestors = Category.objects.get_queryset_ancestors(categories, include_self=True)
+    return [f'category:{pk}' for pk in ancestors.values_list('id', flat=True)]
+
+
+def get_cache_tags(instance, product_ids):
+    """Return tags of cached responses that depend on the given instance."""
+    tags = [f'product:{pk}' for pk in product_ids]
+    if isinstance(instance, Product):
+        tags.append(f'brand:{instance.brand_id}')
+    elif isinstance(instance, Brand):
+        tags.append(f'brand:{instance.pk}')
+    elif isinstance(instance, Category):
+        # Lists of ancestor categories include products of the category
+        tags += get_category_tags(Category.objects.filter(pk=instance.pk))
+    elif isinstance(instance, ProductAttributeValue):
+        tags += ['attribute-values', f'attribute-value:{instance.pk}']
+    elif isinstance(instance, ProductAttribute):
+        tags.append('attribute-values')
+    return tags
+
+
+def invalidate_cache_on_commit(tags):
+    """Invalidate cached responses once the changes are visible to other requests."""
+    tags = list(tags)
+    if tags:
+        transaction.on_commit(lambda: invalidate_tags(tags))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductInventory)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=ProductAttribute)
+@receiver(post_save, sender=ProductAttributeValue)
+@receiver(post_delete, sender=ProductInventory)
+@receiver(post_delete, sender=ProductImage)
+def refresh_listing_on_change(sender, instance, created=False, **kwargs):
+    """Refresh listing rows and cached responses of products
+       affected by a saved or deleted object."""
+    product_ids = get_affected_product_ids(instance)
+    refresh_listing_rows(product_ids)
+    tags = get_cache_tags(instance, product_ids)
+    if created and sender is Product:
+        # A new product can show up on any list
+        tags.append('product-list')
+    invalidate_cache_on_commit(tags)
+
+
+@receiver(post_save, sender=ProductInventory)
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=ProductInventory)
+@receiver(post_delete, sender=Stock)
+def refresh_price_and_stock_on_change(sender, instance, **kwargs):
+    """Update the denormalized prices and availability of the product
+       of a saved or deleted inventory or stock."""
+    refresh_products_price_and_stock(get_affected_product_ids(instance))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Brand)
+def refresh_search_vector_on_change(sender, instance, **kwargs):
+    """Update the full text search vector of the saved product
+       or of all products of the saved brand."""
+    if isinstance(instance, Brand):
+        Product.objects.filter(brand=instance).refresh_search_vector()
+    else:
+        Product.objects.filter(pk=instance.pk).refresh_search_vector()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Product)
+def invalidate_cache_on_change(sender, instance, **kwargs):
+    """Invalidate cached responses that depend on a saved category
+       or a deleted product. Listing rows do not need a refresh."""
+    tags = get_cache_tags(instance, get_affected_product_ids(instance))
+    if sender is Product:
+        # Counts and pages of all the lists change, not only
+        # of those the deleted product was on
+        tags.append('product-list')
+    invalidate_cache_on_commit(tags)
+
+
+@receiver(post_delete, sender=Product)
+def delete_listing_row_on_delete(sender, instance, **kwargs):
+    """Delete the listing row of a deleted product. Deleting its
+       inventories (before the product) builds the row again."""
+    ProductListingRow.objects.filter(product_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_category_tree_on_change(sender, instance, **kwargs):
+    """Make the cached category tree outdated when any category is saved
+       or deleted. Moving a node with MPTT saves it too."""
+    transaction.on_commit(bump_category_tree_version)
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=ProductAttribute)
+@receiver(pre_delete, sender=ProductAttributeValue)
+def collect_product_ids_before_delete(sender, instance, **kwargs):
+    """Remember affected products before the M2M rows that link them
+       to the deleted object are removed."""
+    instance._affected_product_ids = get_affected_product_ids(instance)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=ProductAttribute)
+@receiver(post_delete, sender=ProductAttributeValue)
+def refresh_listing_after_delete(sender, instance, **kwargs):
+    """Refresh listing rows and cached responses of products
+       that were linked to the deleted object."""
+    product_ids = getattr(instance, '_affected_product_ids', [])
+    refresh_listing_rows(product_ids)
+    invalidate_cache_on_commit(get_cache_tags(instance, product_ids))
+
+
+def get_m2m_affected_product_ids(sender, instance, action, reverse, pk_set):
+    """Return ids of products affected by (un)linking attribute values
+       or categories, or None if there is nothing to update yet."""
+    if action == 'pre_clear':
+        # `pk_set` is not sent on clear, so remember the products beforehand
+        instance._affected_product_ids = get_affected_product_ids(instance)
+        return None
+    if action == 'post_clear':
+        return getattr(instance, '_affected_product_ids', [])
+    if action not in ('post_add', 'post_remove'):
+        return None
+    if not reverse:
+        return get_affected_product_ids(instance)
+    if sender is Product.categories.through:
+        return pk_set
+    return ProductInventory.objects.filter(
+        pk__in=pk_set
+    ).values_list('product_id', flat=True)
+
+
+def get_m2m_cache_tags(sender, instance, action, reverse, pk_set, product_ids):
+    """Return tags of cached responses affected by (un)linking
+       attribute values or categories."""
+    tags = [f'product:{pk}' for pk in product_ids]
+    if sender is Product.categories.through:
+        if reverse:
+            tags += get_category_tags(Category.objects.filter(pk=instance.pk))
+        elif action == 'post_clear':
+            # Cleared categories are not known, any list can be affected
+            tags.append('product-list')
+        else:
+            tags += get_category_tags(Category.objects.filter(pk__in=pk_set))
+    else:
+        # Lists filtered by the (un)linked values
+        if reverse:
+            tags.append(f'attribute-value:{instance.pk}')
+        elif action == 'post_clear':
+            tags.append('product-list')
+        else:
+            tags += [f'attribute-value:{pk}' for pk in pk_set]
+    return tags
+
+
+@receiver(m2m_changed, sender=ProductInventory.attribute_values.through)
+@receiver(m2m_changed, sender=Product.categories.through)
+def refresh_listing_on_m2m_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Refresh listing rows and cached responses when
+       attribute values or categories are (un)linked."""
+    product_ids = get_m2m_affected_product_ids(sender, instance, action, reverse, pk_set)
+    if product_ids is None:
+        return
+    product_ids = list(product_ids)
+    refresh_listing_rows(product_ids)
+    invalidate_cache_on_commit(
+        get_m2m_cache_tags(sender, instance, action, reverse, pk_set, product_ids)
+    )
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    """Elasticsearch signal processor that never calls elasticsearch
+       during the request. Ids of products affected by changes of any
+       indexed model are queued and indexed in bulk by a Celery task,
+       see `inventory.indexing.enqueue_products`."""
+    indexed_models = [
+        Product,
+        ProductInventory,
+        Stock,
+        ProductAttribute,
+        ProductAttributeValue,
+        Brand,
+        Category,
+    ]
+    m2m_senders = [
+        Product.categories.through,
+        ProductInventory.attribute_values.through,
+    ]
+
+    def setup(self):
+        for model in self.indexed_models:
+            post_save.connect(self.handle_save, sender=model)
+            pre_delete.connect(self.handle_pre_delete, sender=model)
+            post_delete.connect(self.handle_delete, sender=model)
+        for sender in self.m2m_senders:
+            m2m_changed.connect(self.handle_m2m_changed, sender=sender)
+
+    def teardown(self):
+        for model in self.indexed_models:
+            post_save.disconnect(self.handle_save, sender=model)
+            pre_delete.disconnect(self.handle_pre_delete, sender=model)
+            post_delete.disconnect(self.handle_delete, sender=model)
+        for sender in self.m2m_senders:
+            m2m_changed.disconnect(self.handle_m2m_changed, sender=sender)
+
+    def handle_save(self, sender, instance, **kwargs):
+        if DEDConfig.autosync_enabled():
+            enqueue_products(get_affected_product_ids(instance))
+
+    def handle_pre_delete(self, sender, instance, **kwargs):
+        # Related products can't be found after the delete
+        if DEDConfig.autosync_enabled():
+            instance._affected_product_ids = get_affected_product_ids(instance)
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if DEDConfig.autosync_enabled():
+            enqueue_products(getattr(instance, '_affected_product_ids', []))
+
+    def handle_m2m_changed(self, sender, instance, action, reverse=False, pk_set=None, **kwargs):
+        if not DEDConfig.autosync_enabled():
+            return
+        product_ids = get_m2m_affected_product_ids(sender, instance, action, reverse, pk_set)
+        if product_ids is not None:
+            enqueue_products(product_ids)
@@ -0,0 +1,76 @@
+"""
+Reserving product inventories' stock for orders.
+"""
+from django.db import transaction
+from django_elasticsearch_dsl.apps import DEDConfig
+
+from .cache import invalidate_tags
+from .indexing import enqueue_products
+from .models import Product, Stock
+
+
+class OutOfStockError(Exception):
+    """Some of the product inventories do not have enough units in stock."""
+
+    def __init__(self, messages):
+        super().__init__(' '.join(messages))
+        self.messages = messages
+
+
+def refresh_products_price_and_stock(product_ids):
+    """Update the denormalized prices, availability and sales of products
+       with the given ids. Cached lists filtered (or ordered) by them
+       are invalidated if any of them changed."""
+    products = Product.objects.filter(pk__in=list(product_ids))
+    fields = ('pk', 'min_price', 'max_price', 'in_stock', 'units_sold')
+    previous = set(products.values_list(*fields))
+    products.refresh_price_and_stock()
+    current = set(products.values_list(*fields))
+
+    tags = []
+    if {row[:4] for row in current} != {row[:4] for row in previous}:
+        # The product can now show up on lists filtered by price or availability
+        tags.append('product-price-stock')
+    if {(row[0], row[4]) for row in current} != {(row[0], row[4]) for row in previous}:
+        # The product can move on lists of bestselling products
+        tags.append('product-sales')
+    if tags:
+        transaction.on_commit(lambda: invalidate_tags(tags))
+
+
+def reserve_stock(quantities):
+    """Take units out of stock of product inventories. `quantities` maps
+       ids of product inventories to numbers of ordered units.
+       Stock rows are locked until the end of the transaction, always
+       in the order of their ids, so concurrent orders wait for each
+       other instead of overselling (or deadlocking).
+       Raises `OutOfStockError` (and changes nothing) if any of the product
+       inventories does not have enough units. It has to run in a transaction."""
+    stocks = list(
+        # Only stock rows are locked, not the joined product inventories
+        Stock.objects.select_for_update(of=('self',)).filter(
+            product_inventory_id__in=list(quantities)
+        ).select_related('product_inventory').order_by('pk')
+    )
+    stocks_by_inventory = {stock.product_inventory_id: stock for stock in stocks}
+
+    errors = []
+    for inventory_id, quantity in quantities.items():
+        stock = stocks_by_inventory.get(inventory_id)
+        if stock is None:
+            errors.append(f'There is no stock of the product inventory {inventory_id}.')
+            continue
+        try:
+            stock.calculate_units(quantity)
+        except ValueError as e:
+            errors.append(f'Product inventory {inventory_id}: {e}.')
+    if errors:
+        raise OutOfStockError(errors)
+
+    # Signals are not sent, so the products are updated below
+    Stock.objects.bulk_update(stocks, ['units', 'units_sold'])
+    product_ids = {stock.product_inventory.product_id for stock in stocks}
+    refresh_products_price_and_stock(product_ids)
+    if DEDConfig.autosync_enabled():
+        enqueue_products(product_ids)
+    return stocks
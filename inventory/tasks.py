@@ -0,0 +1,22 @@
+"""
+Celery tasks for the inventory app.
+"""
+from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.conf import settings
+
+from .indexing import index_queued_products
+
+
+@shared_task(bind=True, max_retries=None)
+def index_queued_products_task(self):
+    """Celery task to index products queued by the `QueuedSignalProcessor`.
+       Products that failed to index are put back in the queue, so the task
+       is retried after PRODUCT_INDEX_RETRY_DELAY seconds to index them."""
+    logger = get_task_logger(__name__)
+    try:
+        indexed = index_queued_products()
+        logger.info(f'{indexed} products indexed')
+    except Exception as e:
+        logger.info(f'{e} error occurred while indexing products')
+        raise self.retry(exc=e, countdown=settings.PRODUCT_INDEX_RETRY_DELAY)
@@ -0,0 +1,107 @@
+"""
+Tests for the async product list views.
+"""
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+
+from inventory.models import Brand, Category, Product, ProductInventory
+from inventory.search import async_search_products, build_product_search, get_async_client
+
+ASYNC_PRODUCTS_URL = reverse('inventory:async-products')
+
+
+def async_products_by_category_url(category_id):
+    """Create and return an async products by category url."""
+    return reverse('inventory:async-products-by-category', args=[category_id])
+
+
+class AsyncProductsViewTests(TestCase):
+    """Tests for the async product list view."""
+
+    def setUp(self):
+        cache.clear()
+        brand = Brand.objects.create(name='test brand')
+        self.category = Category.objects.create(name='category')
+        self.products = [
+            Product.objects.create(
+                name=f'product {i}',
+                description='description',
+                brand=brand
+            )
+            for i in range(12)
+        ]
+        for i, product in enumerate(self.products):
+            ProductInventory.objects.create(product=product, price=f'{i + 1}.00')
+        self.products[0].categories.add(self.category)
+
+    def test_list_products(self):
+        """Test listing products with the async view, page by page."""
+        res = self.client.get(ASYNC_PRODUCTS_URL, {'ordering': 'price'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        data = res.json()
+        self.assertEqual(data['count'], 12)
+        self.assertEqual(len(data['results']), 10)
+        self.assertEqual(data['results'][0]['id'], self.products[0].id)
+        self.assertEqual(data['results'][0]['price'], 1.0)
+        self.assertIsNone(data['previous'])
+
+        res = self.client.get(data['next'])
+        data = res.json()
+        self.assertEqual([p['id'] for p in data['results']], [p.id for p in self.products[10:]])
+        self.assertIsNone(data['next'])
+
+    def test_list_products_by_category(self):
+        """Test listing products of a category with the async view."""
+        res = self.client.get(async_products_by_category_url(self.category.id))
+
+        self.assertEqual(res.json()['count'], 1)
+        self.assertEqual(res.json()['results'][0]['id'], self.products[0].id)
+
+    def test_invalid_filters(self):
+        """Test invalid filters return an error."""
+        res = self.client.get(ASYNC_PRODUCTS_URL, {'price': '10,1'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('inventory.views.async_search_products', new_callable=AsyncMock)
+    def test_search_products(self, patched_search_products):
+        """Test searching products gets the page of hits from the async client."""
+        ids = [self.products[3].id, self.products[1].id]
+        patched_search_products.return_value = (2, ids)
+
+        res = self.client.get(ASYNC_PRODUCTS_URL, {'search': 'product', 'brand': '1'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()['count'], 2)
+        self.assertEqual([p['id'] for p in res.json()['results']], ids)
+        search, start, stop = patched_search_products.call_args.args
+        self.assertEqual((start, stop), (0, 10))
+        self.assertIn({'terms': {'brand_id': [1]}}, search.to_dict()['query']['bool']['filter'])
+
+    @patch('elasticsearch.AsyncElasticsearch')
+    async def test_search_closes_client(self, patched_client_class):
+        """Test the async client is closed after the search."""
+        client = patched_client_class.return_value
+        client.__aenter__.return_value = client
+        client.search = AsyncMock(return_value={
+            'hits': {'total': {'value': 1}, 'hits': [{'_id': '5'}]}
+        })
+
+        count, ids = await async_search_products(build_product_search('product'), 0, 10)
+
+        self.assertEqual((count, ids), (1, [5]))
+        client.__aexit__.assert_awaited_once()
+
+    def test_async_client_needs_aiohttp(self):
+        """Test a clear error is raised if the async client can't be used."""
+        with patch.dict('sys.modules', {'elasticsearch': SimpleNamespace()}):
+            with self.assertRaises(ImproperlyConfigured):
+                get_async_client()
@@ -0,0 +1,334 @@
+"""
+Tests for caching responses of the inventory API.
+"""
+import time
+from unittest.mock import patch
+
+from _decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase
+from django_redis import get_redis_connection
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from inventory.cache import acquire_lock, invalidate_tags, is_locked, release_lock, set_tagged
+from inventory.models import (Brand,
+                              Category,
+                              Product,
+                              ProductAttribute,
+                              ProductAttributeValue,
+                              ProductInventory,
+                              Stock)
+from inventory.stock import reserve_stock
+
+PRODUCTS_URL = reverse('inventory:products')
+ATTRIBUTE_VALUES_URL = reverse('inventory:attribute-values')
+
+
+def products_by_category_url(category_id):
+    """Create and return a products by category url."""
+    return reverse('inventory:products-by-category', args=[category_id])
+
+
+class CacheTests(TestCase):
+    """Tests for the tagged cache of the inventory API."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.brand = Brand.objects.create(name='test brand')
+        self.other_brand = Brand.objects.create(name='other brand')
+        self.product = Product.objects.create(
+            name='test product',
+            description='description',
+            brand=self.brand
+        )
+        self.product_inventory = ProductInventory.objects.create(
+            product=self.product,
+            price='10.00'
+        )
+        self.other_product = Product.objects.create(
+            name='other product',
+            description='description',
+            brand=self.other_brand
+        )
+
+    def test_list_products_cached(self):
+        """Test listing products for the second time does not query the database."""
+        self.client.get(PRODUCTS_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(PRODUCTS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 2)
+
+    def test_invalidation_keeps_later_entries_tagged(self):
+        """Test entries stored while tags are invalidated stay tagged."""
+        set_tagged('first', 1, 60, ['tag'])
+        redis = get_redis_connection('default')
+        sunion = redis.sunion
+
+        def sunion_then_store(*args, **kwargs):
+            keys = sunion(*args, **kwargs)
+            set_tagged('second', 2, 60, ['tag'])
+            return keys
+
+        with patch.object(redis, 'sunion', side_effect=sunion_then_store):
+            invalidate_tags(['tag'])
+
+        self.assertIsNone(cache.get('first'))
+        self.assertEqual(cache.get('second'), 2)
+        invalidate_tags(['tag'])
+        self.assertIsNone(cache.get('second'))
+
+    def test_product_change_invalidates_cache(self):
+        """Test changing a listed product invalidates the cached list."""
+        self.client.get(PRODUCTS_URL, {'brand': self.brand.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product_inventory.price = '5.00'
+            self.product_inventory.save()
+        res = self.client.get(PRODUCTS_URL, {'brand': self.brand.id})
+
+        self.assertEqual(res.data['results'][0]['price'], Decimal('5.00'))
+
+    def test_unrelated_change_keeps_cache(self):
+        """Test changing a product that is not listed keeps the cached list."""
+        self.client.get(PRODUCTS_URL, {'brand': self.brand.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductInventory.objects.create(product=self.other_product, price='1.00')
+
+        with self.assertNumQueries(0):
+            self.client.get(PRODUCTS_URL, {'brand': self.brand.id})
+
+    def test_new_product_invalidates_cache(self):
+        """Test creating a product invalidates cached lists."""
+        self.client.get(PRODUCTS_URL)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                name='new product',
+                description='description',
+                brand=self.brand
+            )
+        res = self.client.get(PRODUCTS_URL)
+
+        self.assertEqual(res.data['count'], 3)
+
+    def test_deleted_product_invalidates_cache(self):
+        """Test deleting a product invalidates cached lists
+           it's not on, e.g. their first pages."""
+        for i in range(10):
+            Product.objects.create(
+                name=f'new product {i}',
+                description='description',
+                brand=self.other_brand
+            )
+        self.client.get(PRODUCTS_URL)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            # The oldest product is on the second page
+            self.product.delete()
+        res = self.client.get(PRODUCTS_URL)
+
+        self.assertEqual(res.data['count'], 11)
+
+    def test_attribute_value_link_invalidates_filtered_cache(self):
+        """Test linking an attribute value to another product
+           invalidates lists filtered by the value."""
+        value = ProductAttributeValue.objects.create(
+            product_attribute=ProductAttribute.objects.create(name='color'),
+            value='red'
+        )
+        self.product_inventory.attribute_values.add(value)
+        other_inventory = ProductInventory.objects.create(product=self.other_product, price='1.00')
+        self.client.get(PRODUCTS_URL, {'attribute-values': value.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other_inventory.attribute_values.add(value)
+        res = self.client.get(PRODUCTS_URL, {'attribute-values': value.id})
+
+        self.assertEqual(res.data['count'], 2)
+
+    def test_category_change_invalidates_cache(self):
+        """Test adding a product to a category invalidates the category list."""
+        category = Category.objects.create(name='category')
+        self.client.get(products_by_category_url(category.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_product.categories.add(category)
+        res = self.client.get(products_by_category_url(category.id))
+
+        self.assertEqual(res.data['results'][0]['id'], self.other_product.id)
+
+    def test_category_change_invalidates_ancestor_cache(self):
+        """Test adding a product to a category invalidates lists of its ancestors."""
+        parent = Category.objects.create(name='parent')
+        category = Category.objects.create(name='category', parent=parent)
+        self.client.get(products_by_category_url(parent.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_product.categories.add(category)
+        res = self.client.get(products_by_category_url(parent.id))
+
+        self.assertEqual(res.data['results'][0]['id'], self.other_product.id)
+
+    def test_availability_change_invalidates_in_stock_cache(self):
+        """Test a product coming back in stock invalidates lists filtered by availability."""
+        self.client.get(PRODUCTS_URL, {'in-stock': 'true'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Stock.objects.create(product_inventory=self.product_inventory, units=5)
+        res = self.client.get(PRODUCTS_URL, {'in-stock': 'true'})
+
+        self.assertEqual(res.data['results'][0]['id'], self.product.id)
+
+    def test_sales_change_invalidates_bestselling_cache(self):
+        """Test selling units of a product invalidates lists of bestselling products."""
+        Stock.objects.create(product_inventory=self.product_inventory, units=5)
+        Stock.objects.create(
+            product_inventory=ProductInventory.objects.create(product=self.other_product, price='1.00'),
+            units=5,
+            units_sold=1
+        )
+        self.client.get(PRODUCTS_URL, {'ordering': 'bestselling'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                reserve_stock({self.product_inventory.id: 2})
+        res = self.client.get(PRODUCTS_URL, {'ordering': 'bestselling'})
+
+        self.assertEqual(res.data['results'][0]['id'], self.product.id)
+
+    def test_attribute_value_change_invalidates_cache(self):
+        """Test creating an attribute value invalidates cached attribute values."""
+        self.client.get(ATTRIBUTE_VALUES_URL)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductAttributeValue.objects.create(
+                product_attribute=ProductAttribute.objects.create(name='color'),
+                value='red'
+            )
+        res = self.client.get(ATTRIBUTE_VALUES_URL)
+
+        self.assertEqual(res.data['count'], 1)
+
+    def test_equivalent_filters_share_cache(self):
+        """Test requests with equivalent filters share one cache entry."""
+        self.client.get(PRODUCTS_URL, {'brand': f'{self.other_brand.id},{self.brand.id}', 'price': '1,20'})
+
+        with self.assertNumQueries(0):
+            res = self.client.get(PRODUCTS_URL, {'price': '01,20', 'brand': f'{self.brand.id},{self.other_brand.id}'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_cache_does_not_vary_on_cookie(self):
+        """Test visitors with different cookies share one cache entry."""
+        self.client.get(PRODUCTS_URL)
+        self.client.cookies['csrftoken'] = 'some-token'
+
+        with self.assertNumQueries(0):
+            res = self.client.get(PRODUCTS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_cache_varies_on_auth_state(self):
+        """Test anonymous and authenticated users do not share cache entries."""
+        user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='password123'
+        )
+        self.client.get(PRODUCTS_URL)
+        self.client.force_authenticate(user)
+
+        with self.assertNumQueries(3):
+            self.client.get(PRODUCTS_URL)
+
+
+class CacheStampedeTests(TestCase):
+    """Tests for the stampede protection of the tagged cache."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        brand = Brand.objects.create(name='test brand')
+        Product.objects.create(
+            name='test product',
+            description='description',
+            brand=brand
+        )
+        self.client.get(PRODUCTS_URL)
+        self.key = cache.keys('inventory:response:ListProductsAPIView:*')[0]
+
+    def expire_entry(self):
+        """Make the cached entry past its (soft) expiry."""
+        entry = cache.get(self.key)
+        entry['expires_at'] = time.time() - 1
+        entry['data']['count'] = 'stale'
+        cache.set(self.key, entry)
+
+    def test_expired_entry_rebuilt(self):
+        """Test an expired entry is rebuilt by the request and the lock is released."""
+        self.expire_entry()
+
+        with self.assertNumQueries(3):
+            res = self.client.get(PRODUCTS_URL)
+
+        self.assertEqual(res.data['count'], 1)
+        self.assertFalse(is_locked(f'{self.key}:lock'))
+        self.assertEqual(cache.get(self.key)['data']['count'], 1)
+
+    def test_stale_entry_served_while_rebuilt(self):
+        """Test other requests serve the stale entry while one rebuilds it."""
+        self.expire_entry()
+        acquire_lock(f'{self.key}:lock', 30)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(PRODUCTS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 'stale')
+
+    @patch('inventory.cache.TaggedCacheMixin.cache_lock_wait', 0.2)
+    def test_missing_entry_waits_for_rebuild(self):
+        """Test a request without any entry to serve waits for
+           the lock holder, then builds the response itself."""
+        cache.delete(self.key)
+        acquire_lock(f'{self.key}:lock', 30)
+
+        with self.assertNumQueries(3):
+            res = self.client.get(PRODUCTS_URL)
+
+        self.assertEqual(res.data['count'], 1)
+
+    def test_lock_released_only_by_holder(self):
+        """Test an expired lock taken by another request
+           is not released by the previous holder."""
+        lock_key = f'{self.key}:lock'
+        token = acquire_lock(lock_key, 30)
+        get_redis_connection('default').delete(lock_key)
+        other_token = acquire_lock(lock_key, 30)
+
+        release_lock(lock_key, token)
+        self.assertTrue(is_locked(lock_key))
+        self.assertIsNone(acquire_lock(lock_key, 30))
+
+        release_lock(lock_key, other_token)
+        self.assertFalse(is_locked(lock_key))
+
+    @patch('inventory.cache.random.random', return_value=1 - 1e-9)
+    def test_entry_refreshed_early(self, patched_random):
+        """Test an entry can be refreshed before it expires."""
+        entry = cache.get(self.key)
+        entry['expires_at'] = time.time() + 60
+        entry['compute_time'] = 5
+        cache.set(self.key, entry)
+
+        with self.assertNumQueries(3):
+            self.client.get(PRODUCTS_URL)
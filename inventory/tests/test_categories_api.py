@@ -1,6 +1,7 @@
 """
 Tests for API calls that retrieve categories.
 """
+from django.core.cache import cache
 from django.test import TestCase
 from django.urls import reverse
 
@@ -10,6 +11,7 @@ from rest_framework import status
 from inventory.models import Category
 
 MAIN_CATEGORIES_URL = reverse('inventory:main-categories')
+CATEGORY_TREE_URL = reverse('inventory:category-tree')
 
 
 def create_category(name='Test category', parent=None):
@@ -26,6 +28,7 @@ class CategoryAPITests(TestCase):
     """Tests for the category related API calls."""
 
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
 
     def test_list_main_categories(self):
@@ -78,3 +81,49 @@ class CategoryAPITests(TestCase):
         self.assertEqual(res.data['children'][0]['id'], category_grandchild.id)
         self.assertEqual(res.data['children'][0]['name'], category_grandchild.name)
         self.assertIn('children', res.data['children'][0])
+
+    def test_category_tree(self):
+        """Test retrieving the whole nested category tree."""
+        main = create_category(name='main')
+        child = create_category(name='child', parent=main)
+        grandchild = create_category(name='grandchild', parent=child)
+        other_main = create_category(name='other main')
+
+        res = self.client.get(CATEGORY_TREE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([node['id'] for node in res.data], [main.id, other_main.id])
+        child_node = res.data[0]['children'][0]
+        self.assertEqual(child_node['id'], child.id)
+        self.assertEqual(child_node['children'][0]['id'], grandchild.id)
+        self.assertEqual(child_node['children'][0]['level'], 2)
+        self.assertEqual(res.data[1]['children'], [])
+
+    def test_category_tree_cached(self):
+        """Test the category tree is loaded with one query and then cached."""
+        main = create_category(name='main')
+        create_category(name='child', parent=main)
+
+        with self.assertNumQueries(1):
+            self.client.get(CATEGORY_TREE_URL)
+        with self.assertNumQueries(0):
+            res = self.client.get(CATEGORY_TREE_URL)
+
+        self.assertEqual(len(res.data[0]['children']), 1)
+
+    def test_category_tree_updated_on_change(self):
+        """Test the cached category tree is rebuilt when a category is added or moved."""
+        main = create_category(name='main')
+        other_main = create_category(name='other main')
+        self.client.get(CATEGORY_TREE_URL)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            child = create_category(name='child', parent=main)
+        res = self.client.get(CATEGORY_TREE_URL)
+        self.assertEqual(res.data[0]['children'][0]['id'], child.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            child.move_to(other_main)
+        res = self.client.get(CATEGORY_TREE_URL)
+        self.assertEqual(res.data[0]['children'], [])
+        self.assertEqual(res.data[1]['children'][0]['id'], child.id)
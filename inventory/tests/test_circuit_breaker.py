@@ -0,0 +1,81 @@
+"""
+Tests for the circuit breaker.
+"""
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from inventory.circuit_breaker import CircuitBreaker, CircuitBreakerError
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """Tests for the circuit breaker."""
+
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker('test', errors=(ValueError,), failure_threshold=2)
+        self.failing = MagicMock(side_effect=ValueError)
+
+    def test_opens_after_failures(self):
+        """Test the circuit opens after the threshold of failures
+           and calls fail right away while it's open."""
+        for _ in range(2):
+            with self.assertRaises(CircuitBreakerError):
+                self.breaker.call(self.failing)
+        func = MagicMock()
+
+        self.assertTrue(self.breaker.is_open())
+        with self.assertRaises(CircuitBreakerError):
+            self.breaker.call(func)
+        func.assert_not_called()
+
+    def test_other_errors_are_not_counted(self):
+        """Test errors the breaker does not protect from are raised as they are."""
+        with self.assertRaises(KeyError):
+            self.breaker.call(MagicMock(side_effect=KeyError))
+
+        self.assertFalse(self.breaker.is_open())
+
+    def test_failed_trial_opens_again(self):
+        """Test the first failure after the recovery timeout opens the circuit."""
+        self.breaker.open()
+        cache.delete('inventory:circuit-breaker:test:open')
+
+        with self.assertRaises(CircuitBreakerError):
+            self.breaker.call(self.failing)
+
+        self.assertTrue(self.breaker.is_open())
+
+    def test_successful_trial_closes(self):
+        """Test a success after the recovery timeout closes the circuit."""
+        self.breaker.open()
+        cache.delete('inventory:circuit-breaker:test:open')
+
+        self.assertEqual(self.breaker.call(lambda: 'ok'), 'ok')
+        with self.assertRaises(CircuitBreakerError):
+            self.breaker.call(self.failing)
+
+        self.assertFalse(self.breaker.is_open())
+
+    def test_single_trial(self):
+        """Test other calls fail right away while the trial is running."""
+        self.breaker.open()
+        cache.delete('inventory:circuit-breaker:test:open')
+        func = MagicMock()
+
+        def trial():
+            with self.assertRaises(CircuitBreakerError):
+                self.breaker.call(func)
+            return 'ok'
+
+        self.assertEqual(self.breaker.call(trial), 'ok')
+        func.assert_not_called()
+        self.assertEqual(self.breaker.call(func), func.return_value)
+
+    def test_success_without_state_deletes_nothing(self):
+        """Test successful calls of a healthy service do not write to the cache."""
+        with patch.object(cache, 'delete_many') as delete_many:
+            self.assertEqual(self.breaker.call(lambda: 'ok'), 'ok')
+
+        delete_many.assert_not_called()
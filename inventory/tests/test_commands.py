@@ -0,0 +1,143 @@
+"""
+Tests for the inventory app Django management commands.
+"""
+from io import StringIO
+from unittest.mock import patch, MagicMock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from inventory.documents import ProductDocument
+from inventory.indexing import build_product_actions, enqueue_products, stop_recording_changes
+from inventory.models import (Brand,
+                              Category,
+                              Product,
+                              ProductAttribute,
+                              ProductAttributeValue,
+                              ProductInventory,
+                              ProductListingRow)
+
+
+def fake_parallel_bulk(client, actions, **kwargs):
+    """Stand-in for the elasticsearch parallel_bulk helper
+       that reports every action as successful."""
+    for action in actions:
+        yield True, {'index': {'_id': action['_id']}}
+
+
+class CommandTests(TestCase):
+    """Tests for the inventory app commands."""
+
+    def setUp(self):
+        brand = Brand.objects.create(name='test brand')
+        self.parent_category = Category.objects.create(name='parent category')
+        self.category = Category.objects.create(name='test category', parent=self.parent_category)
+        product_attr = ProductAttribute.objects.create(name='color')
+        self.products = []
+        for i in range(4):
+            product = Product.objects.create(
+                name=f'test product {i}',
+                description='description',
+                brand=brand
+            )
+            product.categories.add(self.category)
+            product_inventory = ProductInventory.objects.create(product=product, price='12.50')
+            product_inventory.attribute_values.add(
+                ProductAttributeValue.objects.create(
+                    product_attribute=product_attr,
+                    value=f'value {i}'
+                )
+            )
+            self.products.append(product)
+        self.product = self.products[0]
+
+    def test_rebuild_listing(self):
+        """Test the rebuild_listing command recreates listing rows."""
+        ProductListingRow.objects.all().delete()
+
+        call_command('rebuild_listing')
+
+        row = ProductListingRow.objects.get(product=self.product)
+        self.assertEqual(str(row.min_price), '12.50')
+        self.assertEqual(row.payload['name'], self.product.name)
+
+    def test_build_product_actions_queries(self):
+        """Test documents are built with a fixed number of queries per chunk."""
+        # 5 queries for each of 2 chunks and 1 to find out there are no more products
+        with self.assertNumQueries(11):
+            actions = list(build_product_actions('product-new', chunk_size=2))
+
+        self.assertEqual(len(actions), 4)
+        self.assertEqual(actions[0]['_index'], 'product-new')
+        self.assertEqual(actions[0]['_id'], self.product.id)
+        self.assertEqual(actions[0]['_source']['brand'], 'test brand')
+        self.assertEqual(actions[0]['_source']['attributes'], ['color value 0'])
+        self.assertEqual(actions[0]['_source']['min_price'], 12.5)
+        self.assertEqual(actions[0]['_source']['category_ids'], [self.parent_category.id, self.category.id])
+
+    def test_document_actions_queries(self):
+        """Test the document loads ancestors of categories
+           with one query for all the products."""
+        products = list(Product.objects.for_indexing())
+
+        with self.assertNumQueries(1):
+            actions = list(ProductDocument()._get_actions(products, 'index'))
+
+        self.assertEqual(actions[0]['_source']['category_ids'], [self.parent_category.id, self.category.id])
+
+    @patch('inventory.indexing.parallel_bulk', side_effect=fake_parallel_bulk)
+    @patch('inventory.management.commands.reindex_products.ProductDocument._get_connection')
+    def test_reindex_products(self, patched_get_connection, patched_parallel_bulk):
+        """Test reindexing products into a new index and swapping the alias."""
+        client = MagicMock()
+        client.indices.exists_alias.return_value = True
+        client.indices.get_alias.return_value = {'product-old': {'aliases': {'product': {}}}}
+        patched_get_connection.return_value = client
+        out = StringIO()
+
+        call_command('reindex_products', '--workers', '2', stdout=out)
+
+        new_index = client.indices.create.call_args.kwargs['index']
+        self.assertTrue(new_index.startswith('product-'))
+        self.assertEqual(patched_parallel_bulk.call_args.kwargs['thread_count'], 2)
+        client.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'add': {'index': new_index, 'alias': 'product'}},
+            {'remove': {'index': 'product-old', 'alias': 'product'}},
+        ]})
+        client.indices.delete.assert_called_once_with(index='product-old')
+        self.assertIn('4 products indexed', out.getvalue())
+        self.assertIn('docs/s', out.getvalue())
+
+    @patch('inventory.tasks.index_queued_products_task')
+    @patch('inventory.management.commands.reindex_products.enqueue_products')
+    @patch('inventory.management.commands.reindex_products.ProductDocument._get_connection')
+    def test_reindex_products_requeues_changes(self, patched_get_connection,
+                                               patched_enqueue_products, patched_task):
+        """Test products changed during the load are queued again after
+           the swap, they were indexed into the old index."""
+        patched_get_connection.return_value = MagicMock()
+
+        def parallel_bulk_with_change(client, actions, **kwargs):
+            with self.captureOnCommitCallbacks(execute=True):
+                enqueue_products([self.product.id])
+            yield from fake_parallel_bulk(client, actions, **kwargs)
+
+        with patch('inventory.indexing.parallel_bulk', side_effect=parallel_bulk_with_change):
+            call_command('reindex_products', stdout=StringIO())
+
+        patched_enqueue_products.assert_called_once_with([self.product.id])
+        self.assertEqual(stop_recording_changes(), [])
+
+    @patch('inventory.indexing.parallel_bulk', side_effect=ConnectionError('down'))
+    @patch('inventory.management.commands.reindex_products.ProductDocument._get_connection')
+    def test_reindex_products_error(self, patched_get_connection, patched_parallel_bulk):
+        """Test the new index is deleted if indexing raises an error."""
+        client = MagicMock()
+        patched_get_connection.return_value = client
+
+        with self.assertRaises(ConnectionError):
+            call_command('reindex_products', stdout=StringIO())
+
+        new_index = client.indices.create.call_args.kwargs['index']
+        client.indices.delete.assert_called_once_with(index=new_index)
+        client.indices.update_aliases.assert_not_called()
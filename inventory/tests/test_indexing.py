@@ -0,0 +1,162 @@
+"""
+Tests for queued, bulk indexing of products in Elasticsearch.
+"""
+from unittest.mock import patch
+
+from celery.exceptions import Retry
+from django.test import TestCase, override_settings
+from django_redis import get_redis_connection
+from kombu.exceptions import OperationalError
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from inventory.indexing import (enqueue_products,
+                                index_queued_products,
+                                INDEX_QUEUE_KEY,
+                                INDEX_FLUSH_SCHEDULED_KEY)
+from inventory.tasks import index_queued_products_task
+from inventory.models import (Brand,
+                              Category,
+                              Product,
+                              ProductAttribute,
+                              ProductAttributeValue,
+                              ProductInventory)
+
+
+class IndexingTests(TestCase):
+    """Tests for indexing products through the queue."""
+
+    def setUp(self):
+        self.redis = get_redis_connection('default')
+        self.redis.delete(INDEX_QUEUE_KEY, INDEX_FLUSH_SCHEDULED_KEY)
+        self.brand = Brand.objects.create(name='test brand')
+        self.product = Product.objects.create(
+            name='test product',
+            description='description',
+            brand=self.brand
+        )
+        self.product_inventory = ProductInventory.objects.create(
+            product=self.product,
+            price='10.00'
+        )
+
+    @override_settings(ELASTICSEARCH_DSL_AUTOSYNC=True)
+    @patch('inventory.signals.enqueue_products')
+    def test_processor_queues_related_products(self, patched_enqueue_products):
+        """Test changes of related models queue affected products."""
+        attr_value = ProductAttributeValue.objects.create(
+            product_attribute=ProductAttribute.objects.create(name='color'),
+            value='red'
+        )
+
+        self.product_inventory.attribute_values.add(attr_value)
+        patched_enqueue_products.assert_called_with([self.product.id])
+
+        patched_enqueue_products.reset_mock()
+        attr_value.value = 'blue'
+        attr_value.save()
+        patched_enqueue_products.assert_called_once_with([self.product.id])
+
+        patched_enqueue_products.reset_mock()
+        self.brand.name = 'new name'
+        self.brand.save()
+        patched_enqueue_products.assert_called_once_with([self.product.id])
+
+    @override_settings(ELASTICSEARCH_DSL_AUTOSYNC=True)
+    @patch('inventory.signals.enqueue_products')
+    def test_processor_queues_products_of_descendant_categories(self, patched_enqueue_products):
+        """Test renaming a category queues products of its descendants,
+           they are indexed with names of their ancestors."""
+        parent_category = Category.objects.create(name='parent category')
+        self.product.categories.add(Category.objects.create(name='category', parent=parent_category))
+
+        patched_enqueue_products.reset_mock()
+        parent_category.name = 'new name'
+        parent_category.save()
+        patched_enqueue_products.assert_called_once_with([self.product.id])
+
+    @override_settings(PRODUCT_INDEX_BATCH_SIZE=10, PRODUCT_INDEX_BATCH_DELAY_MS=200)
+    @patch('inventory.tasks.index_queued_products_task')
+    def test_enqueue_products_coalesces(self, patched_task):
+        """Test queued products are indexed by a single, delayed flush."""
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_products([1, 2])
+            enqueue_products([2, 3])
+
+        patched_task.apply_async.assert_called_once_with(countdown=0.2)
+        patched_task.delay.assert_not_called()
+        self.assertEqual(self.redis.smembers(INDEX_QUEUE_KEY), {b'1', b'2', b'3'})
+
+    @override_settings(PRODUCT_INDEX_BATCH_SIZE=2)
+    @patch('inventory.tasks.index_queued_products_task')
+    def test_enqueue_products_full_batch(self, patched_task):
+        """Test a full batch of queued products is flushed right away."""
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_products([1, 2])
+
+        patched_task.delay.assert_called_once()
+
+    @patch('inventory.tasks.index_queued_products_task')
+    def test_enqueue_products_broker_down(self, patched_task):
+        """Test products stay queued and no error is raised
+           if the flush can't be scheduled."""
+        patched_task.apply_async.side_effect = OperationalError('broker down')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_products([1, 2])
+
+        self.assertEqual(self.redis.smembers(INDEX_QUEUE_KEY), {b'1', b'2'})
+
+    @patch('inventory.indexing.get_redis_connection', side_effect=RedisConnectionError('redis down'))
+    def test_enqueue_products_redis_down(self, patched_get_redis_connection):
+        """Test no error is raised after the commit if Redis is down."""
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_products([1, 2])
+
+        patched_get_redis_connection.assert_called_once()
+
+    @override_settings(PRODUCT_INDEX_RETRY_DELAY=5)
+    @patch('inventory.indexing.bulk', side_effect=ConnectionError)
+    def test_index_queued_products_task_retries(self, patched_bulk):
+        """Test the flush is retried if indexing fails."""
+        self.redis.sadd(INDEX_QUEUE_KEY, self.product.id)
+
+        with patch.object(index_queued_products_task, 'retry', return_value=Retry()) as patched_retry:
+            with self.assertRaises(Retry):
+                index_queued_products_task()
+
+        self.assertEqual(patched_retry.call_args.kwargs['countdown'], 5)
+        self.assertEqual(self.redis.scard(INDEX_QUEUE_KEY), 1)
+
+    @patch('inventory.indexing.bulk')
+    def test_index_queued_products(self, patched_bulk):
+        """Test queued products are indexed and deleted ones removed."""
+        self.redis.sadd(INDEX_QUEUE_KEY, self.product.id, 999999)
+
+        indexed = index_queued_products()
+
+        actions = patched_bulk.call_args.args[1]
+        self.assertEqual(indexed, 2)
+        self.assertEqual(
+            {(action['_op_type'], action['_id']) for action in actions},
+            {('index', self.product.id), ('delete', 999999)}
+        )
+        self.assertEqual(self.redis.scard(INDEX_QUEUE_KEY), 0)
+
+    @patch('inventory.indexing.bulk', side_effect=ConnectionError)
+    def test_index_queued_products_failure(self, patched_bulk):
+        """Test products stay queued if elasticsearch is not available."""
+        self.redis.sadd(INDEX_QUEUE_KEY, self.product.id)
+
+        with self.assertRaises(ConnectionError):
+            index_queued_products()
+
+        self.assertEqual(self.redis.smembers(INDEX_QUEUE_KEY), {str(self.product.id).encode()})
+
+    @override_settings(ELASTICSEARCH_DSL_AUTOSYNC=False)
+    @patch('inventory.signals.enqueue_products')
+    def test_processor_autosync_disabled(self, patched_enqueue_products):
+        """Test nothing is queued when autosync is disabled."""
+        self.product.name = 'new name'
+        self.product.save()
+
+        patched_enqueue_products.assert_not_called()
@@ -1,6 +1,7 @@
 """
 Tests for the inventory app models.
 """
+from _decimal import Decimal
 from django.db import IntegrityError
 from django.test import TestCase
 from django.utils.text import slugify
@@ -11,7 +12,8 @@ from inventory.models import (Category,
                               ProductAttributeValue,
                               Product,
                               ProductInventory,
-                              Stock)
+                              Stock,
+                              ProductListingRow)
 
 
 class ModelTests(TestCase):
@@ -292,3 +294,116 @@ class ModelTests(TestCase):
         )
 
         self.assertEqual(product_inventory.stock, stock)
+
+    def test_product_indexing_category_ancestors(self):
+        """Test products are indexed with ancestors of their categories."""
+        parent_category = Category.objects.create(name='parent category')
+        category = Category.objects.create(name='category', parent=parent_category)
+        product = Product.objects.create(
+            name='test product',
+            description='description',
+            brand=Brand.objects.create(name='test brand')
+        )
+        product.categories.add(category)
+
+        self.assertCountEqual(product.category_ids_indexing, [parent_category.id, category.id])
+        self.assertCountEqual(product.categories_indexing, ['parent category', 'category'])
+        self.assertIn('parent category', product.suggest_indexing)
+
+    def test_product_listing_row_created(self):
+        """Test a listing row is created when a product is created."""
+        brand = Brand.objects.create(name='test brand')
+        product = Product.objects.create(
+            name='test product',
+            description='description',
+            brand=brand
+        )
+        row = ProductListingRow.objects.get(product=product)
+
+        self.assertEqual(row.brand_name, brand.name)
+        self.assertEqual(row.payload['name'], product.name)
+        self.assertIsNone(row.min_price)
+
+    def test_product_listing_row_updated(self):
+        """Test the listing row follows changes of related models."""
+        category = Category.objects.create(name='category')
+        brand = Brand.objects.create(name='test brand')
+        product = Product.objects.create(
+            name='test product',
+            description='description',
+            brand=brand
+        )
+        product_attr = ProductAttribute.objects.create(name='color')
+        attr_value = ProductAttributeValue.objects.create(
+            product_attribute=product_attr,
+            value='red'
+        )
+        product_inventory = ProductInventory.objects.create(
+            product=product,
+            price='20.00'
+        )
+        ProductInventory.objects.create(
+            product=product,
+            price='15.00'
+        )
+        product_inventory.attribute_values.add(attr_value)
+        product.categories.add(category)
+        brand.name = 'new brand name'
+        brand.save()
+        row = ProductListingRow.objects.get(product=product)
+
+        self.assertEqual(row.min_price, Decimal('15.00'))
+        self.assertEqual(row.attribute_value_ids, [attr_value.id])
+        self.assertEqual(row.category_ids, [category.id])
+        self.assertEqual(row.brand_name, 'new brand name')
+        self.assertEqual(row.payload['brand']['name'], 'new brand name')
+
+        attr_value.delete()
+        row.refresh_from_db()
+
+        self.assertEqual(row.attribute_value_ids, [])
+        self.assertEqual(row.payload['all_attribute_values'], [])
+
+    def test_product_listing_row_deleted(self):
+        """Test the listing row is deleted with the product
+           and its inventories."""
+        brand = Brand.objects.create(name='test brand')
+        product = Product.objects.create(
+            name='test product',
+            description='description',
+            brand=brand
+        )
+        ProductInventory.objects.create(product=product, price='20.00')
+        product.delete()
+
+        self.assertFalse(ProductListingRow.objects.exists())
+
+    def test_product_price_and_stock_updated(self):
+        """Test the denormalized prices and availability follow
+           the product inventories and their stock."""
+        brand = Brand.objects.create(name='test brand')
+        product = Product.objects.create(
+            name='test product',
+            description='description',
+            brand=brand
+        )
+        cheap_inventory = ProductInventory.objects.create(product=product, price='15.00')
+        expensive_inventory = ProductInventory.objects.create(product=product, price='20.00')
+        product.refresh_from_db()
+
+        self.assertEqual(product.min_price, Decimal('15.00'))
+        self.assertEqual(product.max_price, Decimal('20.00'))
+        self.assertFalse(product.in_stock)
+
+        stock = Stock.objects.create(product_inventory=expensive_inventory, units=1)
+        cheap_inventory.delete()
+        product.refresh_from_db()
+
+        self.assertEqual(product.min_price, Decimal('20.00'))
+        self.assertTrue(product.in_stock)
+
+        stock.calculate_units(1)
+        stock.save()
+        product.refresh_from_db()
+
+        self.assertFalse(product.in_stock)
@@ -2,13 +2,21 @@
 Tests for API calls that retrieve products.
 """
 from _decimal import Decimal
+from django.core.cache import cache
 from django.test import TestCase
 from django.urls import reverse
 
 from rest_framework.test import APIClient
 from rest_framework import status
 
-from inventory.models import Category, Product, Brand, ProductAttribute, ProductAttributeValue, ProductInventory
+from inventory.models import (Category,
+                              Product,
+                              Brand,
+                              ProductAttribute,
+                              ProductAttributeValue,
+                              ProductInventory,
+                              ProductImage,
+                              Stock)
 
 PRODUCTS_URL = reverse('inventory:products')
 ATTRIBUTE_VALUES_URL = reverse('inventory:attribute-values')
@@ -77,6 +85,7 @@ class ProductsAPITests(TestCase):
     """Tests for the product related API calls."""
 
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.parent_category = create_category(name='parent category')
         self.child_category = create_category(
@@ -190,6 +199,43 @@ class ProductsAPITests(TestCase):
         self.assertEqual(len(results_3), 1)
         self.assertEqual(results_3[0]['id'], product_2.id)
 
+    def test_list_products_by_ancestor_category(self):
+        """Test products linked only to a leaf category are listed in its ancestors, once."""
+        grandchild_category = create_category('grandchild', parent=self.child_category)
+        other_grandchild_category = create_category('other grandchild', parent=self.child_category)
+        product = create_product(
+            new_categories=[grandchild_category, other_grandchild_category],
+            name='leaf product'
+        )
+
+        for category in [self.parent_category, self.child_category]:
+            res = self.client.get(products_by_category_url(category.id))
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            ids = [result['id'] for result in res.data['results']]
+            self.assertEqual(sorted(ids), [self.product.id, product.id])
+
+        res = self.client.get(products_by_category_url(grandchild_category.id))
+        self.assertEqual([result['id'] for result in res.data['results']], [product.id])
+
+    def test_list_products_by_missing_category(self):
+        """Test listing products of a category that does not exist returns no products."""
+        res = self.client.get(products_by_category_url(self.child_category.id + 100))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], [])
+
+    def test_product_details_include_ancestor_categories(self):
+        """Test product details list ancestors of the leaf category of the product."""
+        product = create_product(new_categories=[self.child_category], name='leaf product')
+
+        res = self.client.get(product_details_url(product.id))
+
+        self.assertEqual(
+            [category['id'] for category in res.data['categories']],
+            [self.parent_category.id, self.child_category.id]
+        )
+
     def test_list_all_attribute_values(self):
         """Test listing all attribute values."""
         pa = ProductAttribute.objects.create(name='color')
@@ -281,8 +327,145 @@ class ProductsAPITests(TestCase):
         self.assertEqual(results_2[0]['id'], other_product.id)
         self.assertEqual(results_2[0]['price'], Decimal(other_product_inventory.price))
 
+    def test_filter_products_by_price_range_without_duplicates(self):
+        """Test a product with many inventories in the price range is listed once."""
+        create_product_inventory(product=self.product, price='5.00')
+        create_product_inventory(product=self.product, price='6.00')
+
+        res = self.client.get(PRODUCTS_URL, {'price': '1,10'})
+
+        self.assertEqual(res.data['count'], 1)
+        self.assertEqual(res.data['results'][0]['id'], self.product.id)
+
+    def test_filter_products_in_stock(self):
+        """Test filtering only products that are in stock."""
+        Stock.objects.create(product_inventory=create_product_inventory(self.product), units=1)
+        other_product = create_product(name='other product')
+        Stock.objects.create(product_inventory=create_product_inventory(other_product), units=0)
+
+        res = self.client.get(PRODUCTS_URL, {'in-stock': 'true'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['id'] for result in res.data['results']], [self.product.id])
+
     def test_filter_products_by_price_invalid_range(self):
         """Test error is raised if the price range is invalid."""
         res = self.client.get(PRODUCTS_URL, {'price': '100,5'})
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_products_constant_number_of_queries(self):
+        """Test listing products costs the same number of
+           queries no matter how many products are on the page."""
+        for i in range(10):
+            product = create_product(name=f'listed product {i}')
+            attr_value = create_attribute_value(
+                attr_name=f'attr {i}',
+                attr_value=f'value {i}'
+            )
+            product_inventory = create_product_inventory(
+                product=product,
+                attribute_values=[attr_value]
+            )
+            create_product_inventory(product=product, price='20.00')
+            ProductImage.objects.create(
+                product_inventory=product_inventory,
+                image='uploads/product/test.jpg',
+                alt_text=f'image {i}'
+            )
+
+        # count, products, listing rows
+        with self.assertNumQueries(3):
+            res = self.client.get(PRODUCTS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 10)
+        for result in res.data['results']:
+            if result['id'] == self.product.id:
+                continue
+            self.assertEqual(result['price'], Decimal('10.00'))
+            self.assertEqual(len(result['all_attribute_values']), 1)
+            self.assertIn('uploads/product/test.jpg', result['image']['image'])
+
+    def test_list_products_cursor_pagination(self):
+        """Test listing products with the cursor pagination."""
+        for i in range(11):
+            create_product(name=f'paginated product {i}')
+
+        res_1 = self.client.get(PRODUCTS_URL, {'pagination': 'cursor'})
+
+        self.assertEqual(res_1.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', res_1.data)
+        self.assertEqual(len(res_1.data['results']), 10)
+        self.assertIsNotNone(res_1.data['next'])
+
+        res_2 = self.client.get(res_1.data['next'])
+        ids = [p['id'] for p in res_1.data['results'] + res_2.data['results']]
+
+        self.assertEqual(res_2.status_code, status.HTTP_200_OK)
+        self.assertIsNone(res_2.data['next'])
+        self.assertEqual(
+            ids,
+            list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        )
+
+    def test_list_products_approximate_count(self):
+        """Test approximate count is exact for small lists."""
+        create_product(name='new product')
+
+        res = self.client.get(PRODUCTS_URL, {'count': 'approximate'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 2)
+
+    def test_list_products_ordering(self):
+        """Test ordering products by price, name, sales and creation date."""
+        cheap_product = create_product(name='a cheap product')
+        create_product_inventory(cheap_product, price='5.00')
+        expensive_product = create_product(name='b expensive product')
+        Stock.objects.create(
+            product_inventory=create_product_inventory(expensive_product, price='50.00'),
+            units_sold=3
+        )
+
+        def ordered_ids(ordering):
+            res = self.client.get(PRODUCTS_URL, {'ordering': ordering})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            return [result['id'] for result in res.data['results']]
+
+        # self.product has no inventory, so it has no price and comes last
+        self.assertEqual(
+            ordered_ids('price'),
+            [cheap_product.id, expensive_product.id, self.product.id]
+        )
+        self.assertEqual(
+            ordered_ids('-price'),
+            [expensive_product.id, cheap_product.id, self.product.id]
+        )
+        self.assertEqual(
+            ordered_ids('name'),
+            [cheap_product.id, expensive_product.id, self.product.id]
+        )
+        self.assertEqual(ordered_ids('bestselling')[0], expensive_product.id)
+        self.assertEqual(
+            ordered_ids('newest'),
+            [expensive_product.id, cheap_product.id, self.product.id]
+        )
+
+    def test_list_products_invalid_ordering(self):
+        """Test error is raised if the ordering is not available."""
+        res = self.client.get(PRODUCTS_URL, {'ordering': 'description'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_products_cursor_pagination_ordering(self):
+        """Test the cursor pagination follows the requested ordering."""
+        for i in range(11):
+            create_product_inventory(create_product(name=f'paginated product {i}'), price=f'{20 - i}.00')
+
+        res_1 = self.client.get(PRODUCTS_URL, {'pagination': 'cursor', 'ordering': 'price'})
+        res_2 = self.client.get(res_1.data['next'])
+        prices = [p['price'] for p in res_1.data['results'] + res_2.data['results']]
+
+        self.assertEqual(len(prices), 11)
+        self.assertEqual(prices, sorted(prices))
@@ -0,0 +1,351 @@
+"""
+Tests for searching products with Elasticsearch.
+"""
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from elasticsearch.exceptions import ConnectionError as ESConnectionError
+from elasticsearch_dsl.response import Response
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from inventory.models import Brand, Product
+from inventory.search import (build_product_search,
+                              build_product_facets_search,
+                              build_autocomplete_search,
+                              search_circuit_breaker,
+                              ProductSearchResults)
+
+PRODUCTS_URL = reverse('inventory:products')
+FACETS_URL = reverse('inventory:facets')
+AUTOCOMPLETE_URL = reverse('inventory:autocomplete')
+
+
+def create_search_mock(product_ids, count=None):
+    """Create and return a mock of the elasticsearch search
+       that returns hits with the given product ids."""
+    search = MagicMock()
+    search.to_dict.return_value = {'query': {'match_all': {}}}
+    search.params.return_value = search
+    search.count.return_value = len(product_ids) if count is None else count
+    search.__getitem__.return_value.execute.return_value = [
+        SimpleNamespace(meta=SimpleNamespace(id=str(pk), score=1.0))
+        for pk in product_ids
+    ]
+    return search
+
+
+class SearchTests(TestCase):
+    """Tests for searching products."""
+
+    def setUp(self):
+        self.client = APIClient()
+        brand = Brand.objects.create(name='test brand')
+        self.products = [
+            Product.objects.create(
+                name=f'product {i}',
+                description='description',
+                brand=brand
+            )
+            for i in range(3)
+        ]
+        cache.clear()
+
+    def test_build_product_search_filters(self):
+        """Test all the filters are run as elasticsearch filter clauses."""
+        search = build_product_search(
+            'foo',
+            category_ids=[1],
+            brand_ids=[2, 3],
+            attribute_value_ids=[4],
+            price_range=(5, 10),
+            in_stock=True
+        )
+        query = search.to_dict()['query']['bool']
+
+        self.assertEqual(query['must'][0]['multi_match']['query'], 'foo')
+        self.assertIn({'terms': {'category_ids': [1]}}, query['filter'])
+        self.assertIn({'terms': {'brand_id': [2, 3]}}, query['filter'])
+        self.assertIn({'terms': {'attribute_value_ids': [4]}}, query['filter'])
+        self.assertIn({'range': {'min_price': {'gte': 5, 'lte': 10}}}, query['filter'])
+        self.assertIn({'term': {'in_stock': True}}, query['filter'])
+
+    def test_build_product_search_ordering(self):
+        """Test search results are sorted by relevance unless the ordering is given."""
+        search = build_product_search('foo')
+        self.assertNotIn('sort', search.to_dict())
+
+        search = build_product_search('foo', ordering=('-min_price', 'name'))
+        self.assertEqual(
+            search.to_dict()['sort'],
+            [{'min_price': {'order': 'desc'}}, 'name.raw']
+        )
+
+    def test_search_results_slice(self):
+        """Test slicing search results fetches only the requested
+           page of hits and keeps their order."""
+        ids = [self.products[2].id, self.products[0].id]
+        search = create_search_mock(ids, count=50)
+        results = ProductSearchResults(search)
+
+        page = results[10:12]
+
+        search.__getitem__.assert_called_once_with(slice(10, 12))
+        self.assertEqual([product.id for product in page], ids)
+        self.assertEqual(results.count(), 50)
+
+    def test_search_results_cached(self):
+        """Test repeated searches get counts and hits from the cache."""
+        ids = [self.products[2].id, self.products[0].id]
+        ProductSearchResults(create_search_mock(ids)).count()
+        ProductSearchResults(create_search_mock(ids))[0:2]
+        search = create_search_mock([])
+        results = ProductSearchResults(search)
+
+        self.assertEqual(results.count(), 2)
+        self.assertEqual([product.id for product in results[0:2]], ids)
+        search.count.assert_not_called()
+        search.__getitem__.assert_not_called()
+
+    @patch('inventory.views.build_product_search')
+    def test_search_products(self, patched_build_product_search):
+        """Test searching products returns the page from elasticsearch."""
+        ids = [self.products[1].id, self.products[2].id]
+        patched_build_product_search.return_value = create_search_mock(ids)
+
+        res = self.client.get(PRODUCTS_URL, {'search': 'product', 'brand': '1,2'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 2)
+        self.assertEqual([p['id'] for p in res.data['results']], ids)
+        self.assertEqual(
+            patched_build_product_search.call_args.kwargs['brand_ids'],
+            [1, 2]
+        )
+        self.assertIsNone(patched_build_product_search.call_args.kwargs['ordering'])
+
+    @patch('inventory.views.build_product_search')
+    def test_search_products_ordering(self, patched_build_product_search):
+        """Test searching products passes the requested ordering to elasticsearch."""
+        patched_build_product_search.return_value = create_search_mock([])
+
+        self.client.get(PRODUCTS_URL, {'search': 'product', 'ordering': 'bestselling'})
+
+        self.assertEqual(
+            patched_build_product_search.call_args.kwargs['ordering'],
+            ('-units_sold', '-id')
+        )
+
+    def test_facets_filters(self):
+        """Test facets are not narrowed by their own filter."""
+        search = build_product_facets_search(
+            'foo',
+            category_ids=[1],
+            brand_ids=[2],
+            price_range=(5, 10)
+        ).to_dict()
+
+        self.assertEqual(search['size'], 0)
+        # The total count is exact, not capped at 10000
+        self.assertTrue(search['track_total_hits'])
+        self.assertEqual(search['query']['bool']['filter'], [{'terms': {'category_ids': [1]}}])
+        self.assertEqual(
+            search['aggs']['brands']['filter']['bool']['filter'],
+            [{'range': {'min_price': {'gte': 5, 'lte': 10}}}]
+        )
+        self.assertEqual(
+            search['aggs']['prices']['filter']['bool']['filter'],
+            [{'terms': {'brand_id': [2]}}]
+        )
+        self.assertEqual(search['aggs']['prices']['aggs']['values']['histogram']['field'], 'min_price')
+        self.assertEqual(len(search['post_filter']['bool']['filter']), 2)
+
+    @patch('inventory.views.build_product_facets_search')
+    def test_list_facets(self, patched_build_facets_search):
+        """Test listing counts of products for filter values."""
+        search = build_product_facets_search()
+        raw_response = {
+            'hits': {'total': {'value': 3, 'relation': 'eq'}, 'hits': []},
+            'aggregations': {
+                'attribute_values': {'doc_count': 3, 'values': {'buckets': [{'key': 4, 'doc_count': 2}]}},
+                'brands': {'doc_count': 3, 'values': {'buckets': [{'key': 1, 'doc_count': 3}]}},
+                'categories': {'doc_count': 3, 'values': {'buckets': []}},
+                'prices': {'doc_count': 3, 'values': {'buckets': [{'key': 10.0, 'doc_count': 1}]}},
+            }
+        }
+        patched_search = MagicMock()
+        patched_search.params.return_value = patched_search
+        patched_search.execute.return_value = Response(search, raw_response)
+        patched_build_facets_search.return_value = patched_search
+
+        res = self.client.get(FACETS_URL, {'search': 'foo', 'brand': '1'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 3)
+        self.assertEqual(res.data['attribute_values'], [{'id': 4, 'count': 2}])
+        self.assertEqual(res.data['brands'], [{'id': 1, 'count': 3}])
+        self.assertEqual(res.data['categories'], [])
+        self.assertEqual(
+            res.data['prices'],
+            [{'min_price': 10.0, 'max_price': 20.0, 'count': 1}]
+        )
+
+    def test_build_autocomplete_search(self):
+        """Test the autocomplete uses only the completion suggester."""
+        search = build_autocomplete_search('har').to_dict()
+
+        self.assertEqual(search['size'], 0)
+        self.assertEqual(search['suggest']['suggestions']['text'], 'har')
+        self.assertEqual(search['suggest']['suggestions']['completion']['size'], 10)
+
+    @patch('inventory.search.build_autocomplete_search')
+    def test_autocomplete(self, patched_build_autocomplete_search):
+        """Test autocomplete returns suggestions, cached by the normalized prefix."""
+        raw_response = {
+            'hits': {'total': {'value': 0, 'relation': 'eq'}, 'hits': []},
+            'suggest': {'suggestions': [{
+                'text': 'har',
+                'offset': 0,
+                'length': 3,
+                'options': [
+                    {'text': 'Harry Potter', '_index': 'product', '_id': '1', '_score': 1.0},
+                    {'text': 'Harper', '_index': 'product', '_id': '2', '_score': 1.0},
+                ]
+            }]}
+        }
+        patched_search = MagicMock()
+        patched_search.params.return_value = patched_search
+        patched_search.execute.return_value = Response(build_autocomplete_search('har'), raw_response)
+        patched_build_autocomplete_search.return_value = patched_search
+
+        res = self.client.get(AUTOCOMPLETE_URL, {'search': 'Har'})
+        self.client.get(AUTOCOMPLETE_URL, {'search': ' har '})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['suggestions'], ['Harry Potter', 'Harper'])
+        patched_build_autocomplete_search.assert_called_once_with('har')
+
+    @patch('inventory.search.build_autocomplete_search')
+    def test_autocomplete_elasticsearch_down(self, patched_build_autocomplete_search):
+        """Test autocomplete returns no suggestions when elasticsearch is down."""
+        patched_search = MagicMock()
+        patched_search.params.return_value = patched_search
+        patched_search.execute.side_effect = ESConnectionError('N/A', 'down', None)
+        patched_build_autocomplete_search.return_value = patched_search
+
+        res = self.client.get(AUTOCOMPLETE_URL, {'search': 'har'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['suggestions'], [])
+
+    @patch('inventory.views.build_product_facets_search')
+    def test_facets_elasticsearch_down(self, patched_build_facets_search):
+        """Test facets respond with 503 when elasticsearch is down."""
+        patched_search = MagicMock()
+        patched_search.params.return_value = patched_search
+        patched_search.execute.side_effect = ESConnectionError('N/A', 'down', None)
+        patched_build_facets_search.return_value = patched_search
+
+        res = self.client.get(FACETS_URL, {'search': 'foo'})
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_autocomplete_empty_prefix(self):
+        """Test autocomplete does not query elasticsearch without a prefix."""
+        res = self.client.get(AUTOCOMPLETE_URL, {'search': '  '})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['suggestions'], [])
+
+
+class SearchFallbackTests(TestCase):
+    """Tests for searching products in the database
+       when elasticsearch is unavailable."""
+
+    def setUp(self):
+        self.client = APIClient()
+        brand = Brand.objects.create(name='acme')
+        self.lamp = Product.objects.create(
+            name='desk lamp',
+            description='a lamp for the desk',
+            brand=brand
+        )
+        self.chair = Product.objects.create(
+            name='office chair',
+            description='comfortable chair',
+            brand=brand
+        )
+        cache.clear()
+
+    @patch('inventory.views.build_product_search')
+    def test_search_falls_back_to_database(self, patched_build_product_search):
+        """Test products are searched with the full text search
+           when elasticsearch fails, and the response is not cached."""
+        search = create_search_mock([])
+        search.count.side_effect = ESConnectionError('N/A', 'down', None)
+        patched_build_product_search.return_value = search
+
+        res = self.client.get(PRODUCTS_URL, {'search': 'lamps'})
+        self.client.get(PRODUCTS_URL, {'search': 'lamps'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 1)
+        self.assertEqual(res.data['results'][0]['id'], self.lamp.id)
+        self.assertEqual(search.count.call_count, 2)
+
+    @patch('inventory.views.build_product_search')
+    def test_search_falls_back_after_count(self, patched_build_product_search):
+        """Test the count comes from the fallback when elasticsearch
+           fails after counting the hits."""
+        search = create_search_mock([], count=50)
+        search.__getitem__.return_value.execute.side_effect = ESConnectionError('N/A', 'down', None)
+        patched_build_product_search.return_value = search
+
+        res = self.client.get(PRODUCTS_URL, {'search': 'lamps'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 1)
+        self.assertEqual(res.data['results'][0]['id'], self.lamp.id)
+        self.assertIsNone(res.data['next'])
+
+    @patch('inventory.views.build_product_search')
+    def test_open_circuit_skips_elasticsearch(self, patched_build_product_search):
+        """Test elasticsearch is not called while the circuit is open."""
+        search_circuit_breaker.open()
+
+        res = self.client.get(PRODUCTS_URL, {'search': 'acme'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 2)
+        patched_build_product_search.assert_not_called()
+
+    def test_timeout_budget(self):
+        """Test elasticsearch requests get the time left of the budget
+           and the fallback is used once the budget is spent."""
+        search = create_search_mock([self.lamp.id])
+        results = ProductSearchResults(
+            search,
+            fallback=lambda: Product.objects.filter(pk=self.chair.pk),
+            timeout_budget=0.5
+        )
+
+        self.assertEqual(results.count(), 1)
+        self.assertLessEqual(search.params.call_args.kwargs['request_timeout'], 0.5)
+
+        results._deadline -= 1
+        self.assertEqual([product.id for product in results[0:1]], [self.chair.id])
+        self.assertTrue(results.used_fallback)
+
+    def test_brand_rename_updates_search_vector(self):
+        """Test products are found by the new name of their brand."""
+        brand = self.lamp.brand
+        brand.name = 'lumina'
+        brand.save()
+
+        found = Product.objects.full_text_search('lumina')
+
+        self.assertEqual(set(found.values_list('id', flat=True)), {self.lamp.id, self.chair.id})
@@ -10,9 +10,16 @@ app_name = 'inventory'
 urlpatterns = [
     path('main-categories/', views.ListMainCategoriesAPIView.as_view(), name='main-categories'),
     path('categories/<int:pk>/', views.RetrieveCategoryAPIView.as_view(), name='category'),
+    path('category-tree/', views.CategoryTreeAPIView.as_view(), name='category-tree'),
     path('products/', views.ListProductsAPIView.as_view(), name='products'),
     path('products-by-category/<int:pk>/', views.ListProductsAPIView.as_view(), name='products-by-category'),
+    path('async/products/', views.AsyncListProductsView.as_view(), name='async-products'),
+    path('async/products-by-category/<int:pk>/', views.AsyncListProductsView.as_view(),
+         name='async-products-by-category'),
     path('products/<int:pk>/', views.RetrieveProductAPIView.as_view(), name='product-details'),
+    path('facets/', views.ProductFacetsAPIView.as_view(), name='facets'),
+    path('facets-by-category/<int:pk>/', views.ProductFacetsAPIView.as_view(), name='facets-by-category'),
+    path('autocomplete/', views.AutocompleteAPIView.as_view(), name='autocomplete'),
     path('attribute-values/', views.ListAllAttributeValues.as_view(), name='attribute-values'),
 ]
 
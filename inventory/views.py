@@ -1,22 +1,38 @@
 """
 Views for the inventory app.
 """
-from _decimal import Decimal
-from elasticsearch_dsl import Q
+from asgiref.sync import sync_to_async
+from django.db.models import F
+from django.http import HttpResponse
+from django.views import View
+from djangorestframework_camel_case.render import CamelCaseJSONRenderer
+from drf_spectacular.utils import extend_schema
 from rest_framework import generics, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-from django.views.decorators.vary import vary_on_cookie
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-from .documents import ProductDocument
+from e_commerce.pagination import KeysetPagination
+from .cache import TaggedCacheMixin
+from .categories import get_category_tree
+from .listing import get_listing_rows, get_listing_rows_by_ids
 from .models import Product, Category, ProductAttributeValue
-from .serializers import (ProductSerializer,
+from .serializers import (ProductListingRowSerializer,
                           ProductDetailSerializer,
                           CategorySerializer,
+                          CategoryTreeSerializer,
+                          AutocompleteSerializer,
                           ProductAttributeValueSerializer,
-                          ProductSearchSerializer)
+                          ProductFacetsSerializer)
+from .search import (build_product_search,
+                     build_product_facets_search,
+                     get_product_facets,
+                     get_autocomplete_suggestions,
+                     async_search_products,
+                     search_circuit_breaker,
+                     ProductSearchResults)
+from .circuit_breaker import CircuitBreakerError
 
 
 class ListMainCategoriesAPIView(generics.ListAPIView):
@@ -33,53 +49,67 @@ class RetrieveCategoryAPIView(generics.RetrieveAPIView):
     queryset = Category.objects.all()
 
 
-class ListProductsAPIView(generics.ListAPIView):
-    """List products with general information. get_queryset method can
-       handle filtering by category, brand, attribute values, price range and
-       can handle searching for products which is done by using elastic search.
-       Cache is set, so that SQL queries are not needed every time.
-       The cache is set to 30 minutes."""
-    serializer_class = ProductSerializer
-    search_document = ProductDocument
+class CategoryTreeAPIView(generics.GenericAPIView):
+    """Retrieve the whole category tree, e.g. for navigation menus.
+       All categories are loaded with one query ordered by the MPTT
+       bounds and the tree is cached until any category changes."""
+    serializer_class = CategoryTreeSerializer
+    pagination_class = None
+
+    @extend_schema(responses=CategoryTreeSerializer(many=True))
+    def get(self, request, *args, **kwargs):
+        return Response(get_category_tree())
+
+
+class ProductFiltersMixin:
+    """Parsing of the product filters given in query params. It reads
+       `request.GET`, so it works for both DRF and plain Django views."""
 
     @staticmethod
     def _params_to_ints(param_array):
         """Convert a list of string IDs to a list of integers."""
         return [int(str_id) for str_id in param_array.split(',')]
 
-    @method_decorator(vary_on_cookie)
-    @method_decorator(cache_page(60 * 30))
-    def dispatch(self, *args, **kwargs):
-        return super(ListProductsAPIView, self).dispatch(*args, **kwargs)
+    def get_category_ids(self):
+        """Return ids of the category given in the URL and all its
+           descendants, or None if no category was given."""
+        category_pk = self.kwargs.get('pk')
+        if category_pk is None:
+            return None
+        category = Category.objects.filter(pk=category_pk).first()
+        if category is None:
+            return [category_pk]
+        return list(category.get_descendants(include_self=True).values_list('id', flat=True))
 
-    def get_queryset(self):
-        # Check if the category id was provided
-        # if it was, filter by it
+    async def aget_category_ids(self):
+        """Async version of the `get_category_ids`."""
         category_pk = self.kwargs.get('pk')
-        if category_pk:
-            queryset = Product.objects.filter(
-                categories__pk__in=[category_pk]
-            )
-        # else, set queryset to all products
-        else:
-            queryset = Product.objects.all()
+        if category_pk is None:
+            return None
+        category = await Category.objects.filter(pk=category_pk).afirst()
+        if category is None:
+            return [category_pk]
+        descendants = category.get_descendants(include_self=True).values_list('id', flat=True)
+        return [pk async for pk in descendants]
 
-        attribute_values = self.request.query_params.get('attribute-values')
-        brand = self.request.query_params.get('brand')
-        price_range = self.request.query_params.get('price')
-        search_query = self.request.query_params.get('search')
+    def get_filters(self):
+        """Return filters given in query params, validated and converted to ints."""
+        attribute_values = self.request.GET.get('attribute-values')
+        brand = self.request.GET.get('brand')
+        price_range = self.request.GET.get('price')
+        filters = {
+            'attribute_value_ids': None,
+            'brand_ids': None,
+            'price_range': None,
+            'in_stock': self.request.GET.get('in-stock', '').lower() in ('true', '1'),
+        }
 
-        # Filter by attribute values
         if attribute_values:
-            attr_ids = self._params_to_ints(attribute_values)
-            queryset = queryset.filter(inventories__attribute_values__id__in=attr_ids).distinct()
+            filters['attribute_value_ids'] = self._params_to_ints(attribute_values)
 
-        # Filter by brands
         if brand:
-            brand_ids = self._params_to_ints(brand)
-            queryset = queryset.filter(brand__id__in=brand_ids).distinct()
+            filters['brand_ids'] = self._params_to_ints(brand)
 
-        # Filter by price range
         if price_range:
             price_range = price_range.split(',')
             if len(price_range) == 2:
@@ -96,41 +126,303 @@ class ListProductsAPIView(generics.ListAPIView):
                     raise ValidationError(
                         'Invalid price range. The start price has to be lower than the end price.'
                     )
-                queryset = queryset.filter(
-                    inventories__price__range=(start_price, end_price)
-                )
+                filters['price_range'] = (start_price, end_price)
 
-        # Search
+        return filters
+
+
+class ProductListMixin(ProductFiltersMixin):
+    """Filtering and ordering of the product list in the database,
+       shared by the sync and async product list views."""
+    # Value of the `ordering` query param - fields to order products by.
+    # Every ordering is backed by an index.
+    orderings = {
+        'newest': ('-created_at', '-id'),
+        'price': ('min_price', 'id'),
+        '-price': ('-min_price', '-id'),
+        'bestselling': ('-units_sold', '-id'),
+        'name': ('name',),
+    }
+    default_ordering = 'newest'
+    # Products without any inventory have no price, they are listed last
+    nulls_last = {
+        'min_price': F('min_price').asc(nulls_last=True),
+        '-min_price': F('min_price').desc(nulls_last=True),
+    }
+
+    def get_ordering(self):
+        """Return fields to order products by, given in the `ordering` query param."""
+        ordering = self.request.GET.get('ordering', self.default_ordering)
+        if ordering not in self.orderings:
+            raise ValidationError(
+                f'Invalid ordering. Available orderings: {", ".join(self.orderings)}.'
+            )
+        return self.orderings[ordering]
+
+    def filter_products(self, queryset, filters, search_query=None):
+        """Filter and order the products queryset. It does not query the database.
+           With the search query, products are searched with the PostgreSQL
+           full text search (the fallback when elasticsearch is unavailable)
+           and sorted by rank, unless the ordering is given."""
         if search_query:
+            queryset = queryset.full_text_search(search_query)
+
+        # Filter by attribute values
+        if filters['attribute_value_ids']:
+            queryset = queryset.filter(
+                inventories__attribute_values__id__in=filters['attribute_value_ids']
+            ).distinct()
+
+        # Filter by brands
+        if filters['brand_ids']:
+            queryset = queryset.filter(brand__id__in=filters['brand_ids']).distinct()
+
+        # Filter by the (denormalized) lowest price of the product
+        if filters['price_range']:
+            queryset = queryset.filter(min_price__range=filters['price_range'])
+
+        # Filter by availability
+        if filters['in_stock']:
+            queryset = queryset.filter(in_stock=True)
+
+        ordering = self.get_ordering()
+        if search_query and 'ordering' not in self.request.GET:
+            ordering = ('-search_rank', '-id')
+        return queryset.order_by(*(self.nulls_last.get(field, field) for field in ordering))
+
+
+class ListProductsAPIView(TaggedCacheMixin, ProductListMixin, generics.ListAPIView):
+    """List products with general information. get_queryset method can
+       handle filtering by category, brand, attribute values, price range,
+       availability, ordering (see `orderings`) and can handle searching
+       for products which is done by using elastic search.
+       When elasticsearch is slow or down (see `search_circuit_breaker`),
+       products are searched with the PostgreSQL full text search instead.
+       Products are serialized from the precomputed `ProductListingRow` rows.
+       Cursor pagination and approximate counts are available on request,
+       see `KeysetPagination`.
+       Cache is set, so that SQL queries are not needed every time.
+       Cache keys are built from normalized filters and the auth state only.
+       Responses are tagged with ids of listed products, their brands,
+       filtered attribute values and the category, and invalidated when
+       any of them changes. A deleted product invalidates all the lists.
+       Lists filtered (or ordered) by price or availability are also invalidated
+       when a price range or availability of any product changes, lists
+       of bestselling products when sales of any product change.
+       The cache is set to 2 hours. Results of the fallback search
+       are not cached."""
+    serializer_class = ProductListingRowSerializer
+    pagination_class = KeysetPagination
+    cache_timeout = 60 * 60 * 2
+    search_results = None
+    search_fallback = False
+
+    def get_cache_params(self, request):
+        """Normalize the filters, so equivalent requests (like `brand=2,1`
+           and `brand=1,2`) share one cache entry."""
+        params = super().get_cache_params(request)
+        filters = self.get_filters()
+        search_query = request.query_params.get('search', '')
+        params['query'].update({
+            'attribute-values': sorted(set(filters['attribute_value_ids'] or [])),
+            'brand': sorted(set(filters['brand_ids'] or [])),
+            'price': filters['price_range'],
+            'in-stock': filters['in_stock'],
+            'search': ' '.join(search_query.lower().split()),
+        })
+        return params
+
+    def should_cache(self, response):
+        if self.search_fallback or (self.search_results is not None and self.search_results.used_fallback):
+            return False
+        return super().should_cache(response)
+
+    def get_cache_tags(self, data):
+        results = data['results'] if isinstance(data, dict) else data
+        filters = self.get_filters()
+        tags = {'product-list'}
+        tags.update(f'product:{product["id"]}' for product in results)
+        tags.update(f'brand:{product["brand"]["id"]}' for product in results)
+        tags.update(f'brand:{brand_id}' for brand_id in filters['brand_ids'] or [])
+        # Products linked to the values later show up on the list too
+        tags.update(f'attribute-value:{value_id}' for value_id in filters['attribute_value_ids'] or [])
+        if self.kwargs.get('pk'):
+            tags.add(f'category:{self.kwargs["pk"]}')
+        ordering = self.get_ordering()
+        if filters['price_range'] or filters['in_stock'] or 'min_price' in ordering or '-min_price' in ordering:
+            tags.add('product-price-stock')
+        if '-units_sold' in ordering:
+            tags.add('product-sales')
+        return tags
+
+    def list(self, request, *args, **kwargs):
+        """Filter and paginate products as usual, then serialize
+           the page from one listing row per product."""
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None and self.search_results is not None and self.search_results.used_fallback:
+            # Elasticsearch failed after counting the hits
+            self.paginator.recount()
+        rows = get_listing_rows(page if page is not None else queryset)
+        serializer = self.get_serializer(rows, many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    def get_database_queryset(self, filters, search_query=None):
+        """Return the filtered products queryset, it's empty if
+           the category given in the URL does not exist."""
+        queryset = Product.objects.all()
+        # Check if the category id was provided
+        # if it was, filter by it and all its descendants
+        category_pk = self.kwargs.get('pk')
+        if category_pk:
+            category = Category.objects.filter(pk=category_pk).first()
+            if category is None:
+                return Product.objects.none()
+            queryset = queryset.in_category(category)
+        return self.filter_products(queryset, filters, search_query)
+
+    def get_queryset(self):
+        filters = self.get_filters()
+        search_query = self.request.query_params.get('search')
+
+        # Search - all the filters are run by elasticsearch and
+        # the database is queried only for products of the requested page
+        # Search results are sorted by relevance, unless the ordering is given
+        if search_query and not search_circuit_breaker.is_open():
+            search = build_product_search(
+                search_query,
+                category_ids=self.get_category_ids(),
+                ordering=self.get_ordering() if 'ordering' in self.request.query_params else None,
+                **filters
+            )
+            self.search_results = ProductSearchResults(
+                search,
+                fallback=lambda: self.get_database_queryset(filters, search_query)
+            )
+            return self.search_results
+
+        if search_query:
+            self.search_fallback = True
+        return self.get_database_queryset(filters, search_query)
+
+
+class AsyncListProductsView(ProductListMixin, View):
+    """Async version of the `ListProductsAPIView` for ASGI servers (e.g.
+       uvicorn). It accepts the same query params and returns the same
+       page, but waits for elasticsearch (with the `AsyncElasticsearch`
+       client) and the database (with the async ORM) without blocking
+       a worker thread, so one worker can serve many searches at once.
+       When elasticsearch is unavailable, it falls back to the PostgreSQL
+       full text search, like the `ListProductsAPIView`.
+       Searching needs the optional aiohttp package.
+       Responses are not cached and only page numbers are supported."""
+    page_size = api_settings.PAGE_SIZE
+    renderer = CamelCaseJSONRenderer()
+
+    def render(self, data, status_code=status.HTTP_200_OK):
+        return HttpResponse(
+            self.renderer.render(data),
+            content_type='application/json',
+            status=status_code
+        )
+
+    def get_page_number(self):
+        try:
+            page_number = int(self.request.GET.get('page', 1))
+        except ValueError:
+            raise ValidationError('Invalid page.')
+        if page_number < 1:
+            raise ValidationError('Invalid page.')
+        return page_number
+
+    def get_page_link(self, page_number, count):
+        url = self.request.build_absolute_uri()
+        if page_number < 1 or (page_number - 1) * self.page_size >= count:
+            return None
+        if page_number == 1:
+            return remove_query_param(url, 'page')
+        return replace_query_param(url, 'page', page_number)
+
+    async def get_page(self, start, stop):
+        """Return the total count and listing rows of products in the slice."""
+        filters = self.get_filters()
+        search_query = self.request.GET.get('search')
+
+        if search_query:
+            search = build_product_search(
+                search_query,
+                category_ids=await self.aget_category_ids(),
+                ordering=self.get_ordering() if 'ordering' in self.request.GET else None,
+                **filters
+            )
             try:
-                q = Q(
-                    'multi_match',
-                    query=search_query,
-                    fields=[
-                        'name',
-                        'description',
-                        'categories',
-                        'brand',
-                        'attributes'
-                    ],
-                    fuzziness='auto',
-                    minimum_should_match=1
-                )
-                search = ProductDocument.search().query(q).execute()
-                # data is an array of dicts that contain products ids
-                data = ProductSearchSerializer(search, many=True).data
-                products_ids = [d['id'] for d in data]
-
-                # Get the intersection of products_ids and ids of products in the queryset
-                queryset_ids = [q.id for q in queryset]
-                ids = list(set(products_ids) & set(queryset_ids))
-
-                queryset = Product.objects.filter(id__in=ids)
-
-            except Exception as e:
-                return Response(e, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        return queryset
+                count, ids = await async_search_products(search, start, stop)
+            except CircuitBreakerError:
+                # Elasticsearch is unavailable, search in the database
+                pass
+            else:
+                return count, await sync_to_async(get_listing_rows_by_ids)(ids)
+
+        queryset = Product.objects.all()
+        category_pk = self.kwargs.get('pk')
+        if category_pk:
+            category = await Category.objects.filter(pk=category_pk).afirst()
+            if category is None:
+                return 0, []
+            queryset = queryset.in_category(category)
+        queryset = self.filter_products(queryset, filters, search_query)
+        products = [product async for product in queryset[start:stop]]
+        return await queryset.acount(), await sync_to_async(get_listing_rows)(products)
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            page_number = self.get_page_number()
+            start = (page_number - 1) * self.page_size
+            count, rows = await self.get_page(start, start + self.page_size)
+        except ValidationError as e:
+            return self.render(e.detail, status.HTTP_400_BAD_REQUEST)
+        if page_number > 1 and not rows:
+            return self.render({'detail': 'Invalid page.'}, status.HTTP_404_NOT_FOUND)
+
+        serializer = ProductListingRowSerializer(rows, many=True, context={'request': request})
+        return self.render({
+            'count': count,
+            'next': self.get_page_link(page_number + 1, count),
+            'previous': self.get_page_link(page_number - 1, count),
+            'results': serializer.data,
+        })
+
+
+class ProductFacetsAPIView(ProductFiltersMixin, generics.GenericAPIView):
+    """Count products for every attribute value, brand, category and
+       price range, for the current search and filters. It accepts the same
+       query params as the `ListProductsAPIView`. All the counts come from
+       one elasticsearch aggregation request."""
+    serializer_class = ProductFacetsSerializer
+
+    def get(self, request, *args, **kwargs):
+        search = build_product_facets_search(
+            request.query_params.get('search'),
+            category_ids=self.get_category_ids(),
+            **self.get_filters()
+        )
+        serializer = self.get_serializer(get_product_facets(search))
+        return Response(serializer.data)
+
+
+class AutocompleteAPIView(generics.GenericAPIView):
+    """Suggest product names, brands and categories starting with
+       the text given in the `search` query param, while users type.
+       Suggestions come from the elasticsearch completion suggester
+       in one request and are cached by the normalized prefix."""
+    serializer_class = AutocompleteSerializer
+
+    def get(self, request, *args, **kwargs):
+        suggestions = get_autocomplete_suggestions(request.query_params.get('search', ''))
+        serializer = self.get_serializer({'suggestions': suggestions})
+        return Response(serializer.data)
 
 
 class RetrieveProductAPIView(generics.RetrieveAPIView):
@@ -139,15 +431,15 @@ class RetrieveProductAPIView(generics.RetrieveAPIView):
     queryset = Product.objects.all()
 
 
-class ListAllAttributeValues(generics.ListAPIView):
+class ListAllAttributeValues(TaggedCacheMixin, generics.ListAPIView):
     """List all product attribute values. It's designed to be a list
        from which users can choose values to filter products.
        Cache is set, so that SQL queries are not needed every time.
-       The cache is set to 60 minutes."""
+       It's invalidated when any attribute or attribute value changes.
+       The cache is set to 6 hours."""
     serializer_class = ProductAttributeValueSerializer
-    queryset = ProductAttributeValue.objects.all()
+    queryset = ProductAttributeValue.objects.select_related('product_attribute')
+    cache_timeout = 60 * 60 * 6
 
-    @method_decorator(vary_on_cookie)
-    @method_decorator(cache_page(60 * 60))
-    def dispatch(self, *args, **kwargs):
-        return super(ListAllAttributeValues, self).dispatch(*args, **kwargs)
\ No newline at end of file
+    def get_cache_tags(self, data):
+        return ['attribute-values']
\ No newline at end of file
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
-from .models import Order
+from .models import Order, ArchivedOrder
 
 admin.site.register(Order)
+admin.site.register(ArchivedOrder)
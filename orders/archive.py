@@ -0,0 +1,78 @@
+"""
+Moving old orders out of the order tables into the compact archive table.
+"""
+import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem, ArchivedOrder
+
+# Only orders in these statuses are final and can be archived
+ARCHIVED_STATUSES = ('D', 'R')
+CUSTOMER_FIELDS = [
+    'customer_first_name',
+    'customer_last_name',
+    'customer_email',
+    'customer_address',
+    'customer_country',
+    'customer_city',
+    'customer_zip_code',
+]
+
+
+def build_archived_order(order):
+    """Build (without saving) the archived copy of an order.
+       The order should be loaded with prefetched items."""
+    data = {field: getattr(order, field) for field in CUSTOMER_FIELDS}
+    data['items'] = [
+        {
+            'product_inventory': item.product_inventory_id,
+            'quantity': item.quantity,
+            'unit_price': item.unit_price,
+            'line_total': item.line_total,
+        }
+        for item in order.items.all()
+    ]
+    return ArchivedOrder(
+        id=order.id,
+        customer_id=order.customer_id,
+        status=order.status,
+        total_price=order.total_price,
+        data=data,
+        created_at=order.created_at
+    )
+
+
+def archive_order_batch(created_before, batch_size):
+    """Archive up to `batch_size` orders in one transaction.
+       Return the number of archived orders."""
+    with transaction.atomic():
+        # Rows being archived by another worker are skipped
+        orders = list(
+            Order.objects.filter(
+                status__in=ARCHIVED_STATUSES,
+                created_at__lt=created_before
+            ).order_by('id').select_for_update(skip_locked=True).prefetch_related('items')[:batch_size]
+        )
+        if not orders:
+            return 0
+        ArchivedOrder.objects.bulk_create([build_archived_order(order) for order in orders])
+        order_ids = [order.id for order in orders]
+        OrderItem.objects.filter(order_id__in=order_ids).delete()
+        Order.objects.filter(id__in=order_ids).delete()
+    return len(orders)
+
+
+def archive_orders(older_than_days, batch_size=500):
+    """Move delivered and returned orders created more than `older_than_days`
+       days ago to the archive table, in transactions of `batch_size` orders,
+       so the order tables are never locked for long.
+       Return the number of archived orders."""
+    created_before = timezone.now() - datetime.timedelta(days=older_than_days)
+    total = 0
+    while True:
+        archived = archive_order_batch(created_before, batch_size)
+        total += archived
+        if archived < batch_size:
+            return total
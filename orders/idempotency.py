@@ -0,0 +1,107 @@
+"""
+Idempotent creation - requests retried with the same `Idempotency-Key`
+header get the stored response instead of creating objects again.
+"""
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from inventory.cache import acquire_lock, is_locked, release_lock
+
+
+class IdempotentCreateMixin:
+    """Mixin for create views. The first successful response to a request
+       with the `Idempotency-Key` header is stored in the cache (Redis)
+       under the user and the key. Replays of the request get the stored
+       response without running the view (or querying the database).
+       Concurrent requests with the same key wait under a lock
+       for the first one to finish. Requests without the header
+       are handled as usual."""
+    idempotency_header = 'Idempotency-Key'
+    idempotency_timeout = 60 * 60 * 24
+    idempotency_lock_timeout = 30
+    idempotency_lock_wait = 5
+    idempotency_poll_interval = 0.05
+
+    def get_idempotency_cache_key(self, request, idempotency_key):
+        digest = hashlib.md5(idempotency_key.encode()).hexdigest()
+        return f'orders:idempotency:{self.__class__.__name__}:{request.user.pk}:{digest}'
+
+    @staticmethod
+    def get_request_fingerprint(request):
+        """Return a hash of the request body, so a key reused
+           for another request can be told apart from a replay."""
+        body = json.dumps(request.data, sort_keys=True, default=str)
+        return hashlib.md5(body.encode()).hexdigest()
+
+    def replay(self, entry, fingerprint):
+        """Return the stored response, or an error if the key
+           was used for another request."""
+        if entry['fingerprint'] != fingerprint:
+            return Response(
+                {'detail': f'This {self.idempotency_header} was used for another request.'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        return Response(entry['data'], status=entry['status'], headers={'Idempotent-Replayed': 'true'})
+
+    def wait_for_entry(self, key):
+        """Wait for the request holding the lock to store its
+           response, return None on timeout."""
+        deadline = time.monotonic() + self.idempotency_lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(self.idempotency_poll_interval)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+            if not is_locked(f'{key}:lock'):
+                # The request failed, so nothing was stored
+                return None
+        return None
+
+    def create(self, request, *args, **kwargs):
+        idempotency_key = request.headers.get(self.idempotency_header)
+        if not idempotency_key:
+            return super().create(request, *args, **kwargs)
+        if len(idempotency_key) > 255:
+            return Response(
+                {'detail': f'{self.idempotency_header} can be at most 255 characters long.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        key = self.get_idempotency_cache_key(request, idempotency_key)
+        fingerprint = self.get_request_fingerprint(request)
+        entry = cache.get(key)
+        if entry is not None:
+            return self.replay(entry, fingerprint)
+
+        lock_key = f'{key}:lock'
+        token = acquire_lock(lock_key, self.idempotency_lock_timeout)
+        if token is None:
+            # The same request is being handled right now
+            entry = self.wait_for_entry(key)
+            if entry is not None:
+                return self.replay(entry, fingerprint)
+            return Response(
+                {'detail': f'A request with this {self.idempotency_header} is in progress.'},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        try:
+            # The response could be stored between the get and the lock
+            entry = cache.get(key)
+            if entry is not None:
+                return self.replay(entry, fingerprint)
+            response = super().create(request, *args, **kwargs)
+            if status.is_success(response.status_code):
+                cache.set(key, {
+                    'status': response.status_code,
+                    'data': response.data,
+                    'fingerprint': fingerprint,
+                }, self.idempotency_timeout)
+            return response
+        finally:
+            release_lock(lock_key, token)
@@ -0,0 +1,33 @@
+"""
+Django command to move old orders to the archive table.
+"""
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from orders.archive import archive_orders
+
+
+class Command(BaseCommand):
+    """Django command to archive delivered and returned orders older
+       than the given number of days, in batched transactions.
+       It's also run daily by Celery beat, see `CELERY_BEAT_SCHEDULE`."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=settings.ORDERS_ARCHIVE_AFTER_DAYS,
+            help='Archive orders created more than this many days ago.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.ORDERS_ARCHIVE_BATCH_SIZE,
+            help='Number of orders archived in one transaction.'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size has to be positive.')
+        archived = archive_orders(options['older_than_days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{archived} orders archived.'))
@@ -0,0 +1,64 @@
+"""
+Django command to create future and detach old monthly partitions of orders.
+"""
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from orders.partitioning import (month_start,
+                                 is_partitioned,
+                                 get_partitions,
+                                 create_partition,
+                                 detach_partition)
+
+
+class Command(BaseCommand):
+    """Django command to keep monthly partitions of the (optionally)
+       partitioned orders table ready ahead of time, and to detach
+       partitions that are old enough to be archived.
+       It's meant to be run regularly, e.g. once a day."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--table',
+            default='orders_order',
+            help='Partitioned table to manage.'
+        )
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=3,
+            help='Number of future months to create partitions for.'
+        )
+        parser.add_argument(
+            '--detach-older-than',
+            type=int,
+            default=None,
+            help='Detach partitions of months ending more than this many months ago.'
+        )
+
+    def handle(self, *args, **options):
+        if options['months_ahead'] < 0:
+            raise CommandError('--months-ahead can not be negative.')
+        table = options['table']
+        if not is_partitioned(table):
+            self.stdout.write(f'{table} is not partitioned, nothing to do.')
+            return
+
+        this_month = month_start(timezone.now().date())
+        existing = set(get_partitions(table))
+        with transaction.atomic():
+            for months in range(options['months_ahead'] + 1):
+                month = month_start(this_month, months)
+                if month not in existing:
+                    name = create_partition(table, month)
+                    self.stdout.write(f'Created {name}.')
+
+            if options['detach_older_than'] is not None:
+                cutoff = month_start(this_month, -options['detach_older_than'])
+                for month in sorted(existing):
+                    if month_start(month, 1) <= cutoff:
+                        name = detach_partition(table, month)
+                        self.stdout.write(f'Detached {name}.')
+
+        self.stdout.write(self.style.SUCCESS(f'Partitions of {table} are up to date.'))
@@ -0,0 +1,89 @@
+# Generated by Django 4.1.7 on 2026-10-17 03:40
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def copy_products_to_items(apps, schema_editor):
+    """Turn every linked product inventory into an item of one unit,
+       priced at the current price, then store totals of the orders."""
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    OrderProduct = Order.products.through
+    links = OrderProduct.objects.select_related('productinventory').order_by('id')
+    OrderItem.objects.bulk_create(
+        (
+            OrderItem(
+                order_id=link.order_id,
+                product_inventory_id=link.productinventory_id,
+                quantity=1,
+                unit_price=link.productinventory.price,
+                line_total=link.productinventory.price
+            )
+            for link in links.iterator(chunk_size=1000)
+        ),
+        batch_size=1000
+    )
+    totals = OrderItem.objects.filter(
+        order=OuterRef('pk')
+    ).order_by().values('order').annotate(total=Sum('line_total')).values('total')
+    Order.objects.update(total_price=Coalesce(Subquery(totals), 0))
+
+
+def copy_items_to_products(apps, schema_editor):
+    """Link every ordered product inventory to its order again. The link
+       table has one row per product inventory, so quantities are lost."""
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    OrderProduct = Order.products.through
+    items = OrderItem.objects.order_by('id').values_list('order_id', 'product_inventory_id')
+    OrderProduct.objects.bulk_create(
+        (
+            OrderProduct(order_id=order_id, productinventory_id=product_inventory_id)
+            for order_id, product_inventory_id in items.iterator(chunk_size=1000)
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+        ('orders', '0003_created_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='orders.order')),
+                ('product_inventory', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='order_items', to='inventory.productinventory')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'product_inventory'), name='order_item_unique_product_inventory'),
+        ),
+        migrations.RunPython(copy_products_to_items, copy_items_to_products),
+        migrations.RemoveField(
+            model_name='order',
+            name='products',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='products',
+            field=models.ManyToManyField(through='orders.OrderItem', to='inventory.productinventory'),
+        ),
+    ]
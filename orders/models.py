@@ -2,9 +2,38 @@
 Models for the orders' app.
 """
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
 
-from inventory.models import ProductInventory
+from inventory.models import ProductInventory, ProductAttributeValue
+
+
+class OrderQuerySet(models.QuerySet):
+    """Custom queryset for the Order model."""
+
+    def refresh_total_price(self):
+        """Compute the stored `total_price` of the orders
+           from their items with one UPDATE."""
+        totals = OrderItem.objects.filter(
+            order=OuterRef('pk')
+        ).order_by().values('order').annotate(total=Sum('line_total')).values('total')
+        return self.update(total_price=Coalesce(Subquery(totals), 0))
+
+    def with_items(self):
+        """Load items of the orders with their product inventories,
+           products, brands and attribute values up front, so listing
+           orders costs a fixed number of queries."""
+        items = OrderItem.objects.order_by('id').select_related(
+            'product_inventory__product__brand'
+        ).prefetch_related(
+            Prefetch(
+                'product_inventory__attribute_values',
+                queryset=ProductAttributeValue.objects.select_related('product_attribute')
+            )
+        )
+        return self.prefetch_related(Prefetch('items', queryset=items))
 
 
 class Order(models.Model):
@@ -19,7 +48,7 @@ class Order(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.PROTECT
     )
-    products = models.ManyToManyField(ProductInventory)
+    products = models.ManyToManyField(ProductInventory, through='OrderItem')
     customer_first_name = models.CharField(max_length=255)
     customer_last_name = models.CharField(max_length=255)
     customer_email = models.EmailField()
@@ -28,15 +57,84 @@ class Order(models.Model):
     customer_city = models.CharField(max_length=255)
     customer_zip_code = models.CharField(max_length=15)
     status = models.CharField(max_length=1, choices=STATUS_CHOICES, default='P')
+    # Sum of the line totals, computed when the order is created
+    total_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        editable=False
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
-    @property
-    def total_price(self):
-        """Calculate total price of all products."""
-        total = 0
-        for product in self.products.all():
-            total += product.price
-        return total
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Supports listing customer's orders with the keyset (cursor) pagination
+            models.Index(
+                fields=['customer', '-created_at', '-id'],
+                name='order_customer_created_id_idx'
+            ),
+            # Supports listing orders by status, e.g. pending orders to process
+            models.Index(
+                fields=['status', 'created_at'],
+                name='order_status_created_at_idx'
+            ),
+        ]
+
+
+class OrderItem(models.Model):
+    """Order item table - an ordered product inventory with its
+       quantity and the price at the time of the purchase."""
+    order = models.ForeignKey(
+        Order,
+        related_name='items',
+        on_delete=models.CASCADE
+    )
+    product_inventory = models.ForeignKey(
+        ProductInventory,
+        related_name='order_items',
+        on_delete=models.PROTECT
+    )
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    line_total = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['order', 'product_inventory'],
+                name='order_item_unique_product_inventory'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product_inventory}'
+
+
+class ArchivedOrder(models.Model):
+    """Archived order table - a compact copy of an old, delivered
+       or returned order, moved out of the order tables by
+       `orders.archive.archive_orders`. Customer details and items
+       of the order are kept in `data`."""
+    id = models.BigIntegerField(primary_key=True, verbose_name='ID of the archived order')
+    customer = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.PROTECT
+    )
+    status = models.CharField(max_length=1, choices=Order.STATUS_CHOICES)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Supports listing customer's archived orders with the keyset (cursor) pagination
+            models.Index(
+                fields=['customer', '-created_at', '-id'],
+                name='archived_order_customer_idx'
+            ),
+        ]
@@ -0,0 +1,70 @@
+"""
+Monthly range partitions of tables partitioned by `created_at`
+(PostgreSQL declarative partitioning). Partitioning is optional,
+tables that are not partitioned are left alone.
+"""
+import datetime
+import re
+
+from django.db import connection
+
+
+def month_start(date, months=0):
+    """Return the first day of the month of the date, moved by `months`."""
+    month_index = date.year * 12 + date.month - 1 + months
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    """Return the name of the partition of the table for the given month."""
+    return f'{table}_p{month:%Y%m}'
+
+
+def is_partitioned(table):
+    """Return whether the table is a partitioned table."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass',
+            [table]
+        )
+        return cursor.fetchone() is not None
+
+
+def get_partitions(table):
+    """Return months of the monthly partitions attached to the table.
+       Partitions not named by `partition_name` are left out."""
+    pattern = re.compile(rf'^{re.escape(table)}_p(\d{{4}})(\d{{2}})$')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = %s::regclass',
+            [table]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    matches = (pattern.match(name) for name in names)
+    return sorted(datetime.date(int(m[1]), int(m[2]), 1) for m in matches if m)
+
+
+def create_partition(table, month):
+    """Create the partition of the table for the given month,
+       unless it exists. Return its name."""
+    name = partition_name(table, month)
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {quote(name)} PARTITION OF {quote(table)} '
+            f'FOR VALUES FROM (%s) TO (%s)',
+            [month, month_start(month, 1)]
+        )
+    return name
+
+
+def detach_partition(table, month):
+    """Detach the partition of the table for the given month. The detached
+       table is kept, so it can be archived or dropped. Return its name."""
+    name = partition_name(table, month)
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}')
+    return name
@@ -1,11 +1,17 @@
 """
 Serializers for the orders' app.
 """
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
 from inventory.models import ProductInventory, Product, ProductAttribute, ProductAttributeValue
 from inventory.serializers import BrandSerializer
-from .models import Order
+from inventory.stock import OutOfStockError, reserve_stock
+from .models import Order, OrderItem, ArchivedOrder
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -47,8 +53,100 @@ class ProductInventorySerializer(serializers.ModelSerializer):
         fields = ['product', 'attribute_values', 'price']
 
 
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Many related field that fetches all the objects with one query,
+       instead of one query per primary key."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        pks = []
+        for pk in data:
+            if isinstance(pk, bool):
+                self.child_relation.fail('incorrect_type', data_type=type(pk).__name__)
+            try:
+                pks.append(int(pk))
+            except (TypeError, ValueError):
+                self.child_relation.fail('incorrect_type', data_type=type(pk).__name__)
+
+        objects = self.child_relation.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                self.child_relation.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in pks]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key related field, that with `many=True`
+       validates all the primary keys with one query."""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+
+def reserve_order_stock(products_lists):
+    """Take the ordered products out of stock. Every occurrence of a product
+       in the lists is one ordered unit. Raises a validation error
+       if there are not enough units in stock."""
+    quantities = Counter(product.id for products in products_lists for product in products)
+    try:
+        reserve_stock(quantities)
+    except OutOfStockError as e:
+        raise serializers.ValidationError({'products': e.messages})
+
+
+def create_order_items(orders_products):
+    """Create items of orders with one INSERT and compute totals of the
+       orders with one UPDATE. Takes pairs of an order and a list
+       of its products. Every occurrence of a product is one unit,
+       and current prices of the products are stored in the items."""
+    orders_products = list(orders_products)
+    items = []
+    for order, products in orders_products:
+        for product, quantity in Counter(products).items():
+            items.append(OrderItem(
+                order=order,
+                product_inventory=product,
+                quantity=quantity,
+                unit_price=product.price,
+                line_total=product.price * quantity
+            ))
+    OrderItem.objects.bulk_create(items)
+
+    orders = [order for order, _ in orders_products]
+    order_ids = [order.id for order in orders]
+    Order.objects.filter(id__in=order_ids).refresh_total_price()
+    totals = dict(Order.objects.filter(id__in=order_ids).values_list('id', 'total_price'))
+    for order in orders:
+        order.total_price = totals[order.id]
+
+
+class OrderListSerializer(serializers.ListSerializer):
+    """Serializer for creating many orders at once. All the orders
+       and their products are inserted with one query each.
+       Stock of all the ordered products is reserved at once."""
+
+    def create(self, validated_data):
+        products = [data.pop('products') for data in validated_data]
+        with transaction.atomic():
+            reserve_order_stock(products)
+            orders = Order.objects.bulk_create([Order(**data) for data in validated_data])
+            create_order_items(zip(orders, products))
+        prefetch_related_objects(orders, 'products')
+        return orders
+
+
 class OrderSerializer(serializers.ModelSerializer):
     """Serializer for the order model."""
+    products = BulkPrimaryKeyRelatedField(many=True, queryset=ProductInventory.objects.all())
 
     class Meta:
         model = Order
@@ -65,34 +163,72 @@ class OrderSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'id': {'read_only': True}
         }
+        list_serializer_class = OrderListSerializer
 
-    def create(self, validated_data):
-        """Create a new order. Checks if the request contains
-           products, if not - raises an Error."""
-        products = validated_data.pop('products')
+    def validate_products(self, products):
+        """Check if the request contains products, if not - raises an Error."""
         if not products:
             raise serializers.ValidationError('The products list cannot be empty.')
+        return products
 
-        # Create the order
-        order = Order.objects.create(**validated_data)
+    def create(self, validated_data):
+        """Create a new order with all its products in one transaction.
+           The ordered products are taken out of stock in the same transaction."""
+        products = validated_data.pop('products')
+        with transaction.atomic():
+            reserve_order_stock([products])
+            order = Order.objects.create(**validated_data)
+            create_order_items([(order, products)])
+        return order
 
-        # Add products to the order
-        for product in products:
-            order.products.add(product)
 
-        return order
+class OrderItemSerializer(serializers.ModelSerializer):
+    """Serializer for the order item model."""
+    product_inventory = ProductInventorySerializer()
+
+    class Meta:
+        model = OrderItem
+        fields = ['product_inventory', 'quantity', 'unit_price', 'line_total']
+        read_only = True
 
 
 class GetOrderSerializer(OrderSerializer):
     """Serializer for getting order data. It has additional data,
-       not needed to create an order (in `OrderSerializer`)."""
-    products = ProductInventorySerializer(many=True)
+       not needed to create an order (in `OrderSerializer`).
+       Ordered products are listed as items with their quantities
+       and prices at the time of the purchase. `products` is kept
+       for existing clients and lists the product inventories of the items."""
+    products = serializers.SerializerMethodField()
+    items = OrderItemSerializer(many=True)
 
     class Meta(OrderSerializer.Meta):
         fields = OrderSerializer.Meta.fields + [
+            'items',
             'status',
             'customer_email',
             'total_price',
             'created_at'
         ]
         read_only = True
+
+    def get_products(self, order):
+        """Serialize the product inventories of the prefetched items,
+           so the products cost no additional queries."""
+        product_inventories = [item.product_inventory for item in order.items.all()]
+        return ProductInventorySerializer(product_inventories, many=True, context=self.context).data
+
+
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    """Serializer for getting archived order data. Orders are returned
+       in the same shape as by the `GetOrderSerializer`, but items refer
+       to product inventories by ids only."""
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ['id', 'status', 'total_price', 'created_at', 'archived_at']
+        read_only = True
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data.update(instance.data)
+        return data
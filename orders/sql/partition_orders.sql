@@ -0,0 +1,106 @@
+-- Convert the orders_order and orders_orderitem tables to tables partitioned
+-- by the month of created_at (PostgreSQL declarative partitioning).
+--
+-- It is NOT applied by migrations. Back up the database, stop everything
+-- that writes orders and run it once:
+--
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f orders/sql/partition_orders.sql
+--
+-- Then run `python manage.py order_partitions` and
+-- `python manage.py order_partitions --table orders_orderitem` regularly.
+--
+-- Primary keys and unique constraints of a partitioned table have to include
+-- the partition key, so:
+-- - the primary key of orders becomes (id, created_at),
+-- - order items get a created_at column, the time of the transaction that
+--   creates them (all items of an order are created in one transaction),
+--   and it is added to their primary key and unique constraint,
+-- - the foreign key of order items to orders is dropped (Django deletes
+--   items of deleted orders itself).
+-- Existing rows are copied to partitions of all the months since the oldest
+-- order. The original tables are kept as orders_order_unpartitioned and
+-- orders_orderitem_unpartitioned, drop them once the data is checked.
+
+BEGIN;
+
+-- Month bounds are the same as of partitions created by order_partitions
+SET LOCAL TIME ZONE 'UTC';
+
+LOCK TABLE orders_order, orders_orderitem IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE orders_orderitem RENAME TO orders_orderitem_unpartitioned;
+ALTER TABLE orders_order RENAME TO orders_order_unpartitioned;
+
+-- Index names are unique in the schema, free them for the new tables
+DO $$
+DECLARE
+    old_index record;
+BEGIN
+    FOR old_index IN
+        SELECT indexname FROM pg_indexes
+        WHERE tablename IN ('orders_order_unpartitioned', 'orders_orderitem_unpartitioned')
+    LOOP
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', old_index.indexname, left(old_index.indexname, 50) || '_old');
+    END LOOP;
+END $$;
+
+CREATE TABLE orders_order (
+    LIKE orders_order_unpartitioned INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS
+) PARTITION BY RANGE (created_at);
+ALTER TABLE orders_order ADD CONSTRAINT orders_order_pkey PRIMARY KEY (id, created_at);
+ALTER TABLE orders_order ADD CONSTRAINT orders_order_customer_id_0b76f6a4_fk_users_user_id
+    FOREIGN KEY (customer_id) REFERENCES users_user (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX orders_order_customer_id_0b76f6a4 ON orders_order (customer_id);
+CREATE INDEX order_customer_created_id_idx ON orders_order (customer_id, created_at DESC, id DESC);
+CREATE INDEX order_status_created_at_idx ON orders_order (status, created_at);
+
+CREATE TABLE orders_orderitem (
+    LIKE orders_orderitem_unpartitioned INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS,
+    created_at timestamp with time zone NOT NULL DEFAULT transaction_timestamp()
+) PARTITION BY RANGE (created_at);
+ALTER TABLE orders_orderitem ADD CONSTRAINT orders_orderitem_pkey PRIMARY KEY (id, created_at);
+ALTER TABLE orders_orderitem ADD CONSTRAINT order_item_unique_product_inventory
+    UNIQUE (order_id, product_inventory_id, created_at);
+ALTER TABLE orders_orderitem ADD CONSTRAINT orders_orderitem_product_inventory_id_62fe1f71_fk_inventory
+    FOREIGN KEY (product_inventory_id) REFERENCES inventory_productinventory (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX orders_orderitem_order_id_fe61a34d ON orders_orderitem (order_id);
+CREATE INDEX orders_orderitem_product_inventory_id_62fe1f71 ON orders_orderitem (product_inventory_id);
+
+-- Partitions named like the ones of order_partitions, from the month
+-- of the oldest order to 3 months ahead
+DO $$
+DECLARE
+    first_month date := date_trunc('month', coalesce((SELECT min(created_at) FROM orders_order_unpartitioned), now()));
+    last_month date := date_trunc('month', now()) + interval '3 months';
+    partitioned_table text;
+    month date;
+BEGIN
+    FOREACH partitioned_table IN ARRAY ARRAY['orders_order', 'orders_orderitem'] LOOP
+        month := first_month;
+        WHILE month <= last_month LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                partitioned_table || '_p' || to_char(month, 'YYYYMM'),
+                partitioned_table,
+                month,
+                (month + interval '1 month')::date
+            );
+            month := month + interval '1 month';
+        END LOOP;
+    END LOOP;
+END $$;
+
+INSERT INTO orders_order SELECT * FROM orders_order_unpartitioned;
+-- Existing items get the creation time of their order
+INSERT INTO orders_orderitem
+    SELECT item.*, parent.created_at
+    FROM orders_orderitem_unpartitioned item
+    JOIN orders_order_unpartitioned parent ON parent.id = item.order_id;
+
+-- New ids continue after the copied ones
+SELECT setval(pg_get_serial_sequence('orders_order', 'id'), coalesce(max(id), 0) + 1, false)
+FROM orders_order;
+SELECT setval(pg_get_serial_sequence('orders_orderitem', 'id'), coalesce(max(id), 0) + 1, false)
+FROM orders_orderitem;
+
+COMMIT;
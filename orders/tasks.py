@@ -0,0 +1,22 @@
+"""
+Celery tasks for the orders app.
+"""
+from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.conf import settings
+
+from .archive import archive_orders
+
+
+@shared_task
+def archive_orders_task():
+    """Celery (beat) task to archive old, delivered and returned orders."""
+    logger = get_task_logger(__name__)
+    try:
+        archived = archive_orders(
+            settings.ORDERS_ARCHIVE_AFTER_DAYS,
+            settings.ORDERS_ARCHIVE_BATCH_SIZE
+        )
+        logger.info(f'{archived} orders archived')
+    except Exception as e:
+        logger.info(f'{e} error occurred while archiving orders')
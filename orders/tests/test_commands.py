@@ -0,0 +1,163 @@
+"""
+Tests for the orders app Django management commands.
+"""
+import datetime
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from inventory.models import Brand, Product, ProductInventory
+from orders.models import Order, OrderItem, ArchivedOrder
+from orders.partitioning import month_start, get_partitions, create_partition
+from orders.tasks import archive_orders_task
+
+NOW = datetime.datetime(2026, 11, 15, 12, tzinfo=datetime.timezone.utc)
+
+
+class OrderPartitionsCommandTests(TestCase):
+    """Tests for the `order_partitions` command."""
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE partitioned_orders (id bigint, created_at timestamptz NOT NULL) '
+                'PARTITION BY RANGE (created_at)'
+            )
+
+    def call_command(self, *args):
+        out = StringIO()
+        with patch('django.utils.timezone.now', return_value=NOW):
+            call_command('order_partitions', '--table', 'partitioned_orders', *args, stdout=out)
+        return out.getvalue()
+
+    def test_month_start(self):
+        """Test moving dates to the first days of months."""
+        self.assertEqual(month_start(datetime.date(2026, 11, 15)), datetime.date(2026, 11, 1))
+        self.assertEqual(month_start(datetime.date(2026, 11, 15), 2), datetime.date(2027, 1, 1))
+        self.assertEqual(month_start(datetime.date(2026, 1, 31), -1), datetime.date(2025, 12, 1))
+
+    def test_create_partitions_ahead(self):
+        """Test partitions are created for this and the next months."""
+        self.call_command('--months-ahead', '2')
+        self.call_command('--months-ahead', '2')
+
+        self.assertEqual(get_partitions('partitioned_orders'), [
+            datetime.date(2026, 11, 1),
+            datetime.date(2026, 12, 1),
+            datetime.date(2027, 1, 1),
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO partitioned_orders VALUES (1, '2026-12-31 23:00+00')"
+            )
+            cursor.execute('SELECT count(*) FROM partitioned_orders_p202612')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_detach_old_partitions(self):
+        """Test partitions of months older than the given number of months are detached, but kept."""
+        for month in (datetime.date(2026, 8, 1), datetime.date(2026, 9, 1), datetime.date(2026, 10, 1)):
+            create_partition('partitioned_orders', month)
+
+        out = self.call_command('--months-ahead', '0', '--detach-older-than', '1')
+
+        self.assertIn('Detached partitioned_orders_p202608', out)
+        self.assertIn('Detached partitioned_orders_p202609', out)
+        self.assertEqual(get_partitions('partitioned_orders'), [
+            datetime.date(2026, 10, 1),
+            datetime.date(2026, 11, 1),
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('partitioned_orders_p202608')")
+            self.assertIsNotNone(cursor.fetchone()[0])
+
+    def test_table_not_partitioned(self):
+        """Test the command does nothing when the table is not partitioned."""
+        out = StringIO()
+        call_command('order_partitions', stdout=out)
+
+        self.assertIn('orders_order is not partitioned', out.getvalue())
+
+
+class ArchiveOrdersCommandTests(TestCase):
+    """Tests for the `archive_orders` command."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='customer@example.com',
+            password='password123'
+        )
+        product = Product.objects.create(
+            name='test product',
+            brand=Brand.objects.create(name='testBrand')
+        )
+        self.product_inventory = ProductInventory.objects.create(product=product, price='10.00')
+
+    def create_order(self, status, days_ago):
+        order = Order.objects.create(
+            customer=self.user,
+            customer_first_name='Joe',
+            customer_last_name='Eoj',
+            customer_email=self.user.email,
+            customer_address='some street 12/3',
+            customer_country='Poland',
+            customer_city='Poznan',
+            customer_zip_code='12-345',
+            status=status,
+            total_price='20.00'
+        )
+        OrderItem.objects.create(
+            order=order,
+            product_inventory=self.product_inventory,
+            quantity=2,
+            unit_price='10.00',
+            line_total='20.00'
+        )
+        created_at = timezone.now() - datetime.timedelta(days=days_ago)
+        Order.objects.filter(id=order.id).update(created_at=created_at)
+        return order
+
+    def test_archive_orders(self):
+        """Test only old, delivered and returned orders are archived, in batches."""
+        archived = [self.create_order('D', 400), self.create_order('R', 400), self.create_order('D', 500)]
+        kept = [self.create_order('D', 10), self.create_order('P', 400), self.create_order('C', 400)]
+        out = StringIO()
+
+        call_command('archive_orders', '--older-than-days', '365', '--batch-size', '2', stdout=out)
+
+        self.assertIn('3 orders archived', out.getvalue())
+        self.assertEqual(
+            set(Order.objects.values_list('id', flat=True)),
+            {order.id for order in kept}
+        )
+        self.assertEqual(
+            set(ArchivedOrder.objects.values_list('id', flat=True)),
+            {order.id for order in archived}
+        )
+        self.assertFalse(OrderItem.objects.filter(order_id__in=[order.id for order in archived]).exists())
+
+        archived_order = ArchivedOrder.objects.get(id=archived[1].id)
+        self.assertEqual(archived_order.status, 'R')
+        self.assertEqual(archived_order.total_price, Decimal('20.00'))
+        self.assertEqual(archived_order.customer_id, self.user.id)
+        self.assertEqual(archived_order.data['customer_city'], 'Poznan')
+        self.assertEqual(archived_order.data['items'], [{
+            'product_inventory': self.product_inventory.id,
+            'quantity': 2,
+            'unit_price': '10.00',
+            'line_total': '20.00',
+        }])
+
+    @patch('orders.tasks.archive_orders')
+    def test_archive_orders_task(self, patched_archive_orders):
+        """Test the periodic task archives orders with the configured age and batch size."""
+        patched_archive_orders.return_value = 0
+        with self.settings(ORDERS_ARCHIVE_AFTER_DAYS=30, ORDERS_ARCHIVE_BATCH_SIZE=10):
+            archive_orders_task()
+
+        patched_archive_orders.assert_called_once_with(30, 10)
@@ -6,7 +6,7 @@ from django.contrib.auth import get_user_model
 from django.test import TestCase
 
 from inventory.models import Product, Brand, ProductInventory
-from orders.models import Order
+from orders.models import Order, OrderItem
 
 
 class ModelTests(TestCase):
@@ -52,8 +52,8 @@ class ModelTests(TestCase):
         order.status = 'C'
         self.assertEqual(order.status, Order.STATUS_CHOICES[1][0])
 
-    def test_total_price_property(self):
-        """Test total_price property of the Order model."""
+    def test_refresh_total_price(self):
+        """Test total price of the order is computed from its items."""
         order = Order.objects.create(
             customer=self.user,
             customer_first_name='Joe',
@@ -79,7 +79,24 @@ class ModelTests(TestCase):
             product=product,
             price=price_2
         )
-        order.products.add(product_inventory_1)
-        order.products.add(product_inventory_2)
+        OrderItem.objects.create(
+            order=order,
+            product_inventory=product_inventory_1,
+            quantity=2,
+            unit_price=price_1,
+            line_total=Decimal(price_1) * 2
+        )
+        OrderItem.objects.create(
+            order=order,
+            product_inventory=product_inventory_2,
+            unit_price=price_2,
+            line_total=price_2
+        )
+        Order.objects.filter(id=order.id).refresh_total_price()
+        # The price at the time of the purchase is kept
+        product_inventory_1.price = '99.00'
+        product_inventory_1.save()
+        order.refresh_from_db()
 
-        self.assertEqual(order.total_price, Decimal('22.30'))
+        self.assertEqual(order.total_price, Decimal('32.30'))
+        self.assertEqual(order.products.count(), 2)
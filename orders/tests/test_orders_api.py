@@ -1,17 +1,49 @@
 """
 Tests for orders related API calls..
 """
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from types import SimpleNamespace
+
+from unittest.mock import patch
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework.test import APIClient
 from rest_framework import status
 
-from inventory.models import Product, Brand, ProductInventory
-from orders.models import Order
+from inventory.cache import acquire_lock
+from inventory.models import (Product,
+                              Brand,
+                              ProductAttribute,
+                              ProductAttributeValue,
+                              ProductInventory,
+                              Stock)
+from orders.models import Order, OrderItem, ArchivedOrder
+from orders.views import OrderAPIView
 
 ORDERS_URL = reverse('orders:orders')
+BATCH_ORDERS_URL = reverse('orders:batch')
+
+
+def create_order_payload(products, **params):
+    """Create and return a payload of a new order."""
+    payload = {
+        'products': products,
+        'customer_first_name': 'Adam',
+        'customer_last_name': 'Mada',
+        'customer_address': 'main st. 12/3',
+        'customer_country': 'USA',
+        'customer_city': 'Boston',
+        'customer_zip_code': '12-345'
+    }
+    payload.update(params)
+    return payload
 
 
 class PublicOrdersAPITests(TestCase):
@@ -58,6 +90,9 @@ class PrivateOrdersAPITests(TestCase):
             product=self.product,
             price='15.00'
         )
+        Stock.objects.create(product_inventory=self.product_inventory_1, units=10)
+        Stock.objects.create(product_inventory=self.product_inventory_2, units=1)
+        cache.clear()
 
     def test_create_order(self):
         """Test creating a new order is successful."""
@@ -93,6 +128,232 @@ class PrivateOrdersAPITests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_order_queries_do_not_grow_with_cart(self):
+        """Test creating an order runs the same number of queries
+           however many products there are."""
+        inventories = [
+            ProductInventory.objects.create(product=self.product, price='5.00')
+            for _ in range(10)
+        ]
+        for inventory in inventories:
+            Stock.objects.create(product_inventory=inventory, units=5)
+
+        with CaptureQueriesContext(connection) as small_cart:
+            self.client.post(ORDERS_URL, create_order_payload([inventories[0].id]), format='json')
+        with CaptureQueriesContext(connection) as large_cart:
+            res = self.client.post(
+                ORDERS_URL,
+                create_order_payload([inventory.id for inventory in inventories]),
+                format='json'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(large_cart), len(small_cart))
+        self.assertEqual(Order.objects.get(id=res.data['id']).products.count(), 10)
+
+    def test_create_order_locks_only_stock(self):
+        """Test creating an order locks stock rows, but not
+           the product inventories joined to them."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(ORDERS_URL, create_order_payload([self.product_inventory_1.id]), format='json')
+
+        locking = [query['sql'] for query in queries if 'FOR UPDATE' in query['sql']]
+        self.assertEqual(len(locking), 1)
+        self.assertTrue(locking[0].endswith('FOR UPDATE OF "inventory_stock"'))
+
+    def test_create_order_invalid_product_error(self):
+        """Test creating an order with a product that does not exist raises an error."""
+        payload = create_order_payload([self.product_inventory_1.id, 0])
+        res = self.client.post(ORDERS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+    def test_create_order_reserves_stock(self):
+        """Test creating an order takes the ordered units out of stock."""
+        payload = create_order_payload([
+            self.product_inventory_1.id,
+            self.product_inventory_1.id,
+            self.product_inventory_2.id
+        ])
+        res = self.client.post(ORDERS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        stock_1 = Stock.objects.get(product_inventory=self.product_inventory_1)
+        stock_2 = Stock.objects.get(product_inventory=self.product_inventory_2)
+        self.assertEqual((stock_1.units, stock_1.units_sold), (8, 2))
+        self.assertEqual((stock_2.units, stock_2.units_sold), (0, 1))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.units_sold, 3)
+
+    def test_create_order_items(self):
+        """Test repeated products are stored as one item with the quantity,
+           and the total price is stored with the order."""
+        payload = create_order_payload([
+            self.product_inventory_1.id,
+            self.product_inventory_2.id,
+            self.product_inventory_1.id
+        ])
+        res = self.client.post(ORDERS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(id=res.data['id'])
+        items = {item.product_inventory_id: item for item in order.items.all()}
+        self.assertEqual(items[self.product_inventory_1.id].quantity, 2)
+        self.assertEqual(items[self.product_inventory_1.id].unit_price, Decimal('10.00'))
+        self.assertEqual(items[self.product_inventory_1.id].line_total, Decimal('20.00'))
+        self.assertEqual(items[self.product_inventory_2.id].quantity, 1)
+        self.assertEqual(order.total_price, Decimal('35.00'))
+
+    def test_create_order_out_of_stock_error(self):
+        """Test ordering more units than in stock raises an error
+           and does not change any stock."""
+        payload = create_order_payload([
+            self.product_inventory_1.id,
+            self.product_inventory_2.id,
+            self.product_inventory_2.id
+        ])
+        res = self.client.post(ORDERS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(self.product_inventory_2.id), res.data['products'][0])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Stock.objects.get(product_inventory=self.product_inventory_1).units, 10)
+
+    def test_create_order_no_stock_error(self):
+        """Test ordering a product inventory without any stock raises an error."""
+        inventory = ProductInventory.objects.create(product=self.product, price='5.00')
+        res = self.client.post(ORDERS_URL, create_order_payload([inventory.id]), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+    def test_create_order_idempotency_key_replay(self):
+        """Test retrying a request with the same idempotency key returns
+           the first response without creating the order again."""
+        payload = create_order_payload([self.product_inventory_1.id])
+        res = self.client.post(ORDERS_URL, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+
+        with self.assertNumQueries(0):
+            replay = self.client.post(ORDERS_URL, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replay.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replay.data, res.data)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Stock.objects.get(product_inventory=self.product_inventory_1).units, 9)
+
+    def test_create_order_idempotency_key_other_request(self):
+        """Test reusing an idempotency key for another request is an error."""
+        self.client.post(
+            ORDERS_URL,
+            create_order_payload([self.product_inventory_1.id]),
+            format='json',
+            HTTP_IDEMPOTENCY_KEY='key-1'
+        )
+        res = self.client.post(
+            ORDERS_URL,
+            create_order_payload([self.product_inventory_2.id]),
+            format='json',
+            HTTP_IDEMPOTENCY_KEY='key-1'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_create_order_idempotency_key_per_user(self):
+        """Test the same idempotency key of different users does not collide."""
+        payload = create_order_payload([self.product_inventory_1.id])
+        self.client.post(ORDERS_URL, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        other_client = APIClient()
+        other_client.force_authenticate(get_user_model().objects.create_user(
+            email='other@example.com',
+            password='password123'
+        ))
+
+        res = other_client.post(ORDERS_URL, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_create_order_idempotency_key_failure_not_stored(self):
+        """Test failed requests can be retried with the same idempotency key."""
+        payload = create_order_payload([self.product_inventory_2.id, self.product_inventory_2.id])
+        res = self.client.post(ORDERS_URL, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        Stock.objects.filter(product_inventory=self.product_inventory_2).update(units=5)
+        retry = self.client.post(ORDERS_URL, payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+
+    @patch.object(OrderAPIView, 'idempotency_lock_wait', 0.1)
+    def test_create_order_idempotency_key_in_progress(self):
+        """Test a request is rejected while another one
+           with the same idempotency key is in progress."""
+        key = OrderAPIView().get_idempotency_cache_key(SimpleNamespace(user=self.user), 'key-1')
+        acquire_lock(f'{key}:lock', 30)
+
+        res = self.client.post(
+            ORDERS_URL,
+            create_order_payload([self.product_inventory_1.id]),
+            format='json',
+            HTTP_IDEMPOTENCY_KEY='key-1'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Order.objects.exists())
+
+    def test_create_orders_batch(self):
+        """Test creating many orders with one request."""
+        payload = [
+            create_order_payload([self.product_inventory_1.id, self.product_inventory_2.id]),
+            create_order_payload([self.product_inventory_1.id], customer_first_name='Eve'),
+        ]
+        res = self.client.post(BATCH_ORDERS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 2)
+        orders = Order.objects.filter(customer=self.user).order_by('id')
+        self.assertEqual([order.id for order in orders], [order['id'] for order in res.data])
+        self.assertEqual(orders[1].customer_first_name, 'Eve')
+        self.assertEqual(orders[1].customer_email, self.user.email)
+        self.assertEqual(orders[0].total_price, Decimal('25.00'))
+        self.assertEqual(orders[1].total_price, Decimal('10.00'))
+        self.assertEqual(list(orders[1].products.all()), [self.product_inventory_1])
+        self.assertEqual(res.data[0]['products'], [self.product_inventory_1.id, self.product_inventory_2.id])
+
+    def test_create_orders_batch_invalid_order(self):
+        """Test no orders are created if any order in the batch is invalid."""
+        payload = [
+            create_order_payload([self.product_inventory_1.id]),
+            create_order_payload([]),
+        ]
+        res = self.client.post(BATCH_ORDERS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+    def test_create_orders_batch_out_of_stock(self):
+        """Test stock is checked against all the orders of the batch."""
+        payload = [
+            create_order_payload([self.product_inventory_2.id]),
+            create_order_payload([self.product_inventory_2.id]),
+        ]
+        res = self.client.post(BATCH_ORDERS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Stock.objects.get(product_inventory=self.product_inventory_2).units, 1)
+
+    def test_create_orders_batch_too_large(self):
+        """Test batches larger than the limit are rejected."""
+        payload = [create_order_payload([self.product_inventory_1.id])] * 101
+        res = self.client.post(BATCH_ORDERS_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
     def test_list_orders(self):
         """Test listing users orders."""
         order = Order.objects.create(
@@ -105,8 +366,12 @@ class PrivateOrdersAPITests(TestCase):
             customer_city='Poznan',
             customer_zip_code='12-345'
         )
-        order.products.add(
-            self.product_inventory_1
+        OrderItem.objects.create(
+            order=order,
+            product_inventory=self.product_inventory_1,
+            quantity=3,
+            unit_price='9.00',
+            line_total='27.00'
         )
         res = self.client.get(ORDERS_URL)
 
@@ -114,3 +379,171 @@ class PrivateOrdersAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data['count'], 1)
         self.assertEqual(results[0]['id'], order.id)
+        item = results[0]['items'][0]
+        self.assertEqual(item['quantity'], 3)
+        self.assertEqual(item['unit_price'], '9.00')
+        self.assertEqual(item['line_total'], '27.00')
+        self.assertEqual(item['product_inventory']['price'], '10.00')
+        self.assertEqual(results[0]['products'], [item['product_inventory']])
+
+    def test_list_orders_queries(self):
+        """Test listing orders runs a fixed number of queries,
+           however many orders and items there are."""
+        attribute = ProductAttribute.objects.create(name='color')
+        for i in range(5):
+            inventory = ProductInventory.objects.create(product=self.product, price='5.00')
+            inventory.attribute_values.add(
+                ProductAttributeValue.objects.create(product_attribute=attribute, value=f'color {i}')
+            )
+            order = Order.objects.create(
+                customer=self.user,
+                customer_first_name='Joe',
+                customer_last_name='Eoj',
+                customer_email=self.user.email,
+                customer_address='some street 12/3',
+                customer_country='Poland',
+                customer_city='Poznan',
+                customer_zip_code='12-345'
+            )
+            for product_inventory in (inventory, self.product_inventory_1):
+                OrderItem.objects.create(
+                    order=order,
+                    product_inventory=product_inventory,
+                    unit_price='5.00',
+                    line_total='5.00'
+                )
+
+        # Count, orders, items (with inventories, products
+        # and brands) and attribute values (with attributes)
+        with self.assertNumQueries(4):
+            res = self.client.get(ORDERS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 5)
+        self.assertEqual(len(res.data['results'][0]['items']), 2)
+
+    def test_list_archived_orders(self):
+        """Test listing users archived orders."""
+        other_user = get_user_model().objects.create_user(
+            email='other@example.com',
+            password='password123'
+        )
+        archived_order = ArchivedOrder.objects.create(
+            id=123,
+            customer=self.user,
+            status='D',
+            total_price='20.00',
+            data={'customer_city': 'Poznan', 'items': [{'product_inventory': 1, 'quantity': 2}]},
+            created_at='2020-01-01T00:00:00Z'
+        )
+        ArchivedOrder.objects.create(
+            id=124,
+            customer=other_user,
+            status='D',
+            total_price='10.00',
+            data={},
+            created_at='2020-01-01T00:00:00Z'
+        )
+
+        res = self.client.get(ORDERS_URL, {'archived': 'true'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 1)
+        result = res.data['results'][0]
+        self.assertEqual(result['id'], archived_order.id)
+        self.assertEqual(result['total_price'], '20.00')
+        self.assertEqual(result['customer_city'], 'Poznan')
+        self.assertEqual(result['items'], [{'product_inventory': 1, 'quantity': 2}])
+
+    def test_list_orders_cursor_pagination(self):
+        """Test listing users orders with the cursor pagination."""
+        orders = [
+            Order.objects.create(
+                customer=self.user,
+                customer_first_name='Joe',
+                customer_last_name='Eoj',
+                customer_email=self.user.email,
+                customer_address='some street 12/3',
+                customer_country='Poland',
+                customer_city='Poznan',
+                customer_zip_code='12-345'
+            )
+            for _ in range(3)
+        ]
+        res = self.client.get(ORDERS_URL, {'pagination': 'cursor'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', res.data)
+        self.assertEqual(
+            [order['id'] for order in res.data['results']],
+            [order.id for order in reversed(orders)]
+        )
+
+
+class ConcurrentOrdersTests(TransactionTestCase):
+    """Tests for placing orders at the same time. They need
+       real transactions, so they do not run in a test transaction."""
+    customers = 5
+
+    def setUp(self):
+        self.users = [
+            get_user_model().objects.create_user(
+                email=f'customer{i}@example.com',
+                password='password123'
+            )
+            for i in range(self.customers)
+        ]
+        product = Product.objects.create(
+            name='test product',
+            brand=Brand.objects.create(name='testBrand')
+        )
+        self.product_inventory = ProductInventory.objects.create(product=product, price='10.00')
+        Stock.objects.create(product_inventory=self.product_inventory, units=3)
+
+    def place_order(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        try:
+            return client.post(
+                ORDERS_URL,
+                create_order_payload([self.product_inventory.id]),
+                format='json'
+            ).status_code
+        finally:
+            connections.close_all()
+
+    def test_concurrent_orders_do_not_oversell(self):
+        """Test only as many orders as units in stock succeed,
+           when all of them are placed at the same time."""
+        with ThreadPoolExecutor(max_workers=self.customers) as executor:
+            status_codes = list(executor.map(self.place_order, self.users))
+
+        self.assertEqual(status_codes.count(status.HTTP_201_CREATED), 3)
+        self.assertEqual(status_codes.count(status.HTTP_400_BAD_REQUEST), 2)
+        stock = Stock.objects.get(product_inventory=self.product_inventory)
+        self.assertEqual((stock.units, stock.units_sold), (0, 3))
+        self.assertEqual(Order.objects.count(), 3)
+
+    def test_concurrent_retries_create_one_order(self):
+        """Test requests with the same idempotency key sent
+           at the same time create only one order."""
+        def place_order(_):
+            client = APIClient()
+            client.force_authenticate(self.users[0])
+            try:
+                return client.post(
+                    ORDERS_URL,
+                    create_order_payload([self.product_inventory.id]),
+                    format='json',
+                    HTTP_IDEMPOTENCY_KEY='retried'
+                ).status_code
+            finally:
+                connections.close_all()
+
+        cache.clear()
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            status_codes = list(executor.map(place_order, range(3)))
+
+        self.assertEqual(status_codes, [status.HTTP_201_CREATED] * 3)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Stock.objects.get(product_inventory=self.product_inventory).units, 2)
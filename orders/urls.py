@@ -9,4 +9,5 @@ app_name = 'orders'
 
 urlpatterns = [
     path('', views.OrderAPIView.as_view(), name='orders'),
+    path('batch/', views.BatchOrderAPIView.as_view(), name='batch'),
 ]
@@ -1,29 +1,78 @@
 """
 Views for the orders' app.
 """
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework import generics, authentication, permissions
 
-from orders.models import Order
-from orders.serializers import OrderSerializer, GetOrderSerializer
+from e_commerce.pagination import KeysetPagination
+from orders.idempotency import IdempotentCreateMixin
+from orders.models import Order, ArchivedOrder
+from orders.serializers import OrderSerializer, GetOrderSerializer, ArchivedOrderSerializer
 
 
-class OrderAPIView(generics.ListCreateAPIView):
-    """APIView for creating and listing orders."""
+class OrderAPIView(IdempotentCreateMixin, generics.ListCreateAPIView):
+    """APIView for creating and listing orders. Cursor pagination and
+       approximate counts are available on request, see `KeysetPagination`.
+       Listing a page of orders costs a fixed number of queries,
+       however many orders and items there are.
+       Old, delivered and returned orders are moved to the archive
+       (see `orders.archive`), they are listed with `?archived=true`.
+       Retries of a request with the same `Idempotency-Key` header
+       do not create the order again, see `IdempotentCreateMixin`."""
     authentication_classes = [authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def is_archived(self):
+        """Return whether archived orders were requested."""
+        return self.request.query_params.get('archived', '').lower() in ('true', '1')
 
     def get_queryset(self):
-        return Order.objects.filter(customer=self.request.user)
+        if self.request.method == 'GET' and self.is_archived():
+            return ArchivedOrder.objects.filter(customer=self.request.user)
+        return Order.objects.filter(customer=self.request.user).with_items()
 
     def get_serializer_class(self):
         """Return the serializer class for request."""
         if self.request.method == 'GET':
-            return GetOrderSerializer
+            return ArchivedOrderSerializer if self.is_archived() else GetOrderSerializer
         return OrderSerializer
 
+    @extend_schema(parameters=[
+        OpenApiParameter(
+            'archived',
+            OpenApiTypes.BOOL,
+            description='Set to `true` to list archived (old, delivered and returned) orders.'
+        ),
+    ])
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         return serializer.save(
             customer=self.request.user,
             customer_email=self.request.user.email
         )
 
+
+class BatchOrderAPIView(IdempotentCreateMixin, generics.CreateAPIView):
+    """APIView for creating many orders with one request (e.g. for
+       business customers and imports). Either all the orders are created
+       or none of them, with a fixed number of queries however many
+       orders and products there are. It accepts the `Idempotency-Key`
+       header, like the `OrderAPIView`."""
+    authentication_classes = [authentication.TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = OrderSerializer
+    max_batch_size = 100
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.update(many=True, allow_empty=False, max_length=self.max_batch_size)
+        return super().get_serializer(*args, **kwargs)
+
+    def perform_create(self, serializer):
+        return serializer.save(
+            customer=self.request.user,
+            customer_email=self.request.user.email
+        )